@@ -0,0 +1,54 @@
+import struct
+
+from .ingest import Reading, check_timestamp
+from .storage import narrow
+
+# Compact binary reading format (little-endian), used for UDP datagrams
+# and application/octet-stream bodies of /api/update and /api/update/batch.
+#
+#   header   u8 version (=1), u8 room length, room (UTF-8, may be empty)
+#   records  u32 device_id, i64 timestamp ms (0 = time of receipt),
+#            f32 temperature, f32 humidity, f32 pressure    (24 bytes each)
+#
+# An empty room means "keep the room the device is already known by".
+VERSION = 1
+HEADER = struct.Struct("<BB")
+RECORD = struct.Struct("<Iqfff")
+
+# bytes -> (room, iterator of raw (device_id, timestamp, temperature,
+# humidity, pressure) records); the records are unpacked lazily straight
+# from the buffer
+def unpack(data):
+    if len(data) < HEADER.size:
+        raise ValueError("truncated header")
+    version, room_length = HEADER.unpack_from(data)
+    if version != VERSION:
+        raise ValueError(f"unsupported version {version}")
+    offset = HEADER.size + room_length
+    body = len(data) - offset
+    if body < 0 or body % RECORD.size:
+        raise ValueError("truncated record")
+    room = bytes(data[HEADER.size:offset]).decode()
+    return room, RECORD.iter_unpack(memoryview(data)[offset:])
+
+# One raw record -> Reading; room_of(device_id) supplies the room when the
+# header has none and returns None for unknown devices
+def to_reading(record, room, room_of, received_at):
+    device_id, timestamp, temperature, humidity, pressure = record
+    room = room or room_of(device_id)
+    if room is None:
+        raise ValueError(f"no room given for unknown device {device_id}")
+    timestamp = check_timestamp(timestamp, received_at) if timestamp else received_at
+    return Reading(device_id, room, timestamp, narrow(temperature), narrow(humidity), narrow(pressure))
+
+# bytes -> [Reading, ...]
+def decode(data, room_of, received_at):
+    room, records = unpack(data)
+    return [to_reading(record, room, room_of, received_at) for record in records]
+
+def encode(readings, room=""):
+    room = room.encode()
+    parts = [HEADER.pack(VERSION, len(room)), room]
+    for r in readings:
+        parts.append(RECORD.pack(r.device_id, r.timestamp, r.temperature, r.humidity, r.pressure))
+    return b"".join(parts)
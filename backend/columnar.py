@@ -0,0 +1,228 @@
+from array import array
+from bisect import bisect_left
+from heapq import merge
+import mmap
+import os
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .storage import DAY_MS, SegmentStore, from_iso, narrow, segment_start, summary, to_iso
+
+# Column file suffix and array typecode, in record order
+COLUMNS = (("ts", "q"), ("temperature", "f"), ("humidity", "f"), ("pressure", "f"))
+
+def column_paths(ts_path):
+    return [ts_path.with_suffix("." + name) for name, _ in COLUMNS]
+
+# Read-only view of a column file: a memoryview of typecode items straight
+# over the mapped pages. The mapping is released once no view of it is
+# referenced any more.
+def _map(path, typecode):
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return memoryview(array(typecode))
+    with f:
+        size = os.fstat(f.fileno()).st_size
+        size -= size % array(typecode).itemsize
+        if not size:
+            return memoryview(array(typecode))
+        return memoryview(mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)).cast(typecode)
+
+# Views of all columns of a segment, cut to the rows every column has
+def _segment_columns(ts_path):
+    views = [_map(path, typecode) for path, (_, typecode) in zip(column_paths(ts_path), COLUMNS)]
+    count = min(len(view) for view in views)
+    return [view[:count] for view in views]
+
+
+# Day-partitioned per-device store of fixed-width columns.
+#
+#   data/{device_id}/meta.json                as in SegmentStore
+#   data/{device_id}/2025-12-15.ts            int64 epoch ms, oldest first
+#   data/{device_id}/2025-12-15.temperature   float32, one per timestamp
+#   data/{device_id}/2025-12-15.humidity      float32
+#   data/{device_id}/2025-12-15.pressure      float32
+#
+# 20 bytes per sample in native byte order. Appends write the new rows at
+# the end of every column; reads memory-map the columns and bisect the
+# timestamp column, so a range is a set of memoryview slices and nothing is
+# parsed. Same interface as SegmentStore; select it with
+# STORAGE_BACKEND=columns.
+class ColumnStore(SegmentStore):
+    handle_files = len(COLUMNS)
+
+    # [(start_ms, timestamp column path), ...] oldest first
+    def segments(self, device_id):
+        found = []
+        for path in self.device_dir(device_id).glob("*.ts"):
+            try:
+                found.append((from_iso(path.stem), path))
+            except ValueError:
+                continue
+        found.sort()
+        return found
+
+    # A crash mid-append can leave columns of different lengths; cut them
+    # back to the rows all of them hold before the first append.
+    def _repair(self, ts_path):
+        if ts_path in self._repaired:
+            return
+        self._repaired.add(ts_path)
+        paths = column_paths(ts_path)
+        sizes = []
+        for path in paths:
+            try:
+                sizes.append(path.stat().st_size)
+            except FileNotFoundError:
+                sizes.append(0)
+        widths = [array(typecode).itemsize for _, typecode in COLUMNS]
+        count = min(size // width for size, width in zip(sizes, widths))
+        for path, size, width in zip(paths, sizes, widths):
+            if size > count * width:
+                os.truncate(path, count * width)
+
+    def _handle(self, device_id, ts_path):
+        cached = self._handles.get(device_id)
+        if cached is not None and cached[0] == ts_path:
+            self._handles.move_to_end(device_id)
+            return cached[1]
+        if cached is not None:
+            self._close(device_id)
+        self._repair(ts_path)
+        files = [open(path, "ab") for path in column_paths(ts_path)]
+        self._cache_handle(device_id, ts_path, files)
+        return files
+
+    def _close(self, device_id):
+        path, files = self._handles.pop(device_id)
+        for f in files:
+            if f in self._dirty:
+                self._dirty.discard(f)
+                f.flush()
+                os.fsync(f.fileno())
+            f.close()
+
+    def append(self, device_id, room, samples):
+        groups = {}
+        for sample in samples:
+            rows = groups.get(segment_start(sample[0]))
+            if rows is None:
+                rows = groups[segment_start(sample[0])] = [array(typecode) for _, typecode in COLUMNS]
+            for column, value in zip(rows, sample):
+                column.append(value)
+        with self._lock:
+            self._set_room(device_id, room)
+            for start, rows in groups.items():
+                ts_path = self.device_dir(device_id) / (to_iso(start)[:10] + ".ts")
+                files = self._handle(device_id, ts_path)
+                # timestamps last, so a torn append is cut off by _repair
+                for f, column in reversed(list(zip(files, rows))):
+                    f.write(column.tobytes())
+                    f.flush()
+                    self._dirty.add(f)
+
+    # Yield (timestamps, temperatures, humidities, pressures) memoryview
+    # slices per segment, covering start <= timestamp < end. Zero-copy; the
+    # views stay valid for as long as they are referenced.
+    def columns(self, device_id, start=None, end=None):
+        for seg_start, ts_path in self.segments(device_id):
+            if start is not None and seg_start + DAY_MS <= start:
+                continue
+            if end is not None and seg_start >= end:
+                break
+            views = _segment_columns(ts_path)
+            timestamps = views[0]
+            lo = 0 if start is None else bisect_left(timestamps, start)
+            hi = len(timestamps) if end is None else bisect_left(timestamps, end)
+            if hi > lo:
+                yield [view[lo:hi] for view in views]
+
+    def read(self, device_id, start=None, end=None):
+        for timestamps, temperatures, humidities, pressures in self.columns(device_id, start, end):
+            for ts, temperature, humidity, pressure in zip(timestamps, temperatures, humidities, pressures):
+                yield ts, narrow(temperature), narrow(humidity), narrow(pressure)
+
+    def extent(self, device_id, start=None, end=None):
+        total, first, last = 0, None, None
+        for columns in self.columns(device_id, start, end):
+            timestamps = columns[0]
+            total += len(timestamps)
+            first = timestamps[0] if first is None else first
+            last = timestamps[-1]
+        return total, first, last
+
+    # Per-field reductions run over the mapped columns: NumPy when it is
+    # installed, otherwise min/max/sum straight over the memoryviews
+    def aggregate(self, device_id, start=None, end=None):
+        count = 0
+        lows, highs, totals = [float("inf")] * 3, [float("-inf")] * 3, [0.0] * 3
+        for columns in self.columns(device_id, start, end):
+            count += len(columns[0])
+            for i, view in enumerate(columns[1:]):
+                if numpy is not None:
+                    values = numpy.frombuffer(view, dtype=numpy.float32)
+                    low, high, total = float(values.min()), float(values.max()), float(values.sum(dtype=numpy.float64))
+                else:
+                    low, high, total = min(view), max(view), sum(view)
+                lows[i] = min(lows[i], narrow(low))
+                highs[i] = max(highs[i], narrow(high))
+                totals[i] += total
+        result = summary(count, lows, highs, totals)
+        for field, _ in COLUMNS[1:]:
+            if count:
+                result[field]["avg"] = narrow(result[field]["avg"])
+        return result
+
+    def latest(self, device_id):
+        for _, ts_path in reversed(self.segments(device_id)):
+            views = _segment_columns(ts_path)
+            if len(views[0]):
+                ts, temperature, humidity, pressure = (view[-1] for view in views)
+                return ts, narrow(temperature), narrow(humidity), narrow(pressure)
+        return None
+
+    # Columns stay fixed-width so they can be mapped and sliced; nothing to
+    # compress
+    def seal(self, before):
+        return 0
+
+    def drop_before(self, cutoff):
+        reclaimed = 0
+        for device_id in self.devices():
+            for seg_start, ts_path in self.segments(device_id):
+                if seg_start + DAY_MS > cutoff:
+                    break
+                with self._lock:
+                    cached = self._handles.get(device_id)
+                    if cached is not None and cached[0] == ts_path:
+                        self._close(device_id)
+                    for path in column_paths(ts_path):
+                        try:
+                            reclaimed += path.stat().st_size
+                            path.unlink()
+                        except FileNotFoundError:
+                            continue
+                    self._repaired.discard(ts_path)
+        return reclaimed
+
+    # On top of the legacy layouts, convert the .seg segments left by
+    # SegmentStore, merged with any columns the device already has
+    def migrate_legacy(self):
+        super().migrate_legacy()
+        segments = SegmentStore(self.folder)
+        for device_id in self.devices():
+            found = segments.segments(device_id)
+            if not found:
+                continue
+            samples = list(merge(segments.read(device_id), self.read(device_id)))
+            for _, ts_path in self.segments(device_id):
+                for path in column_paths(ts_path):
+                    path.unlink(missing_ok=True)
+            self.append(device_id, self.room(device_id), samples)
+            self.close()
+            for _, path in found:
+                path.unlink()
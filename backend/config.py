@@ -0,0 +1,64 @@
+import os
+
+# Runtime settings, overridable through environment variables
+# (e.g. in the Render dashboard).
+def env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+def env_float(name, default):
+    value = os.environ.get(name)
+    return float(value) if value else default
+
+def env_str(name, default):
+    return os.environ.get(name) or default
+
+# Storage: "segments" (text lines per day), "columns" (memory-mapped
+# fixed-width columns per day, see columnar.py) or "ring" (one fixed-size
+# ring file per device, see ring.py)
+STORAGE_BACKEND = env_str("STORAGE_BACKEND", "segments")
+# Rings hold RETENTION_DAYS of samples at this many seconds apart; devices
+# reporting faster keep proportionally less history
+RING_CADENCE_SECONDS = env_float("RING_CADENCE_SECONDS", 120)
+
+# Retention
+RETENTION_DAYS = env_int("RETENTION_DAYS", 14)
+RETENTION_INTERVAL_SECONDS = env_float("RETENTION_INTERVAL_SECONDS", 300)
+# Compress finished days (see gorilla.py) on each retention run; 0 disables
+SEAL_SEGMENTS = env_int("SEAL_SEGMENTS", 1)
+
+# Ingest
+MAX_CLOCK_SKEW_SECONDS = env_int("MAX_CLOCK_SKEW_SECONDS", 300)
+MAX_BATCH_READINGS = env_int("MAX_BATCH_READINGS", 10000)
+# Shared secret devices present when opening /ws/ingest; unset allows all
+INGEST_TOKEN = env_str("INGEST_TOKEN", "")
+INGEST_DURABILITY = env_str("INGEST_DURABILITY", "batch")
+INGEST_MAX_BATCH = env_int("INGEST_MAX_BATCH", 1000)
+INGEST_HIGH_WATER = env_int("INGEST_HIGH_WATER", 5000)
+# How long /api/write waits out a full ingest queue once part of its body
+# has been stored
+LINE_PROTOCOL_RETRY_SECONDS = env_float("LINE_PROTOCOL_RETRY_SECONDS", 30)
+
+# UDP ingest listener; disabled unless UDP_INGEST_PORT is set. Each source
+# address may send UDP_RATE_PER_MINUTE datagrams with bursts of UDP_BURST.
+UDP_INGEST_HOST = env_str("UDP_INGEST_HOST", "0.0.0.0")
+UDP_INGEST_PORT = env_int("UDP_INGEST_PORT", 0)
+UDP_RATE_PER_MINUTE = env_float("UDP_RATE_PER_MINUTE", 60)
+UDP_BURST = env_int("UDP_BURST", 20)
+
+# Per-device ingest rate limit for the single-reading paths (/api/update,
+# /ws/ingest, UDP); off unless RATE_LIMIT_PER_MINUTE is set.
+# RATE_LIMIT_POLICY is "reject" (429) or "coalesce" (keep the newest).
+RATE_LIMIT_PER_MINUTE = env_float("RATE_LIMIT_PER_MINUTE", 0)
+RATE_LIMIT_BURST = env_int("RATE_LIMIT_BURST", 10)
+RATE_LIMIT_POLICY = env_str("RATE_LIMIT_POLICY", "reject")
+
+# Windows /api/sparklines serves; every window/points shape is built from
+# the whole fleet's history once, so clients cannot pick arbitrary ones
+SPARKLINE_WINDOWS = env_str("SPARKLINE_WINDOWS", "1h,6h,24h,7d")
+
+# Live updates
+SSE_REPLAY_EVENTS = env_int("SSE_REPLAY_EVENTS", 1000)
+SSE_CLIENT_QUEUE = env_int("SSE_CLIENT_QUEUE", 256)
+SSE_HEARTBEAT_SECONDS = env_float("SSE_HEARTBEAT_SECONDS", 15)
+WS_CLIENT_QUEUE = env_int("WS_CLIENT_QUEUE", 64)
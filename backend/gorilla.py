@@ -0,0 +1,255 @@
+import struct
+
+# Gorilla-style compressed segment ("2025-12-15.gor"), written once a day
+# is over and never appended to.
+#
+#   file     MAGIC, then blocks
+#   block    BLOCK header: u32 sample count, u32 payload bytes,
+#            i64 first timestamp ms, i64 last timestamp ms,
+#            u8 scale per field (temperature, humidity, pressure)
+#            payload: bit stream, samples interleaved
+#
+# Every block restarts the encoding, so a reader can skip whole blocks by
+# their header and start decoding at the one holding a given timestamp.
+#
+# Timestamps are delta-of-delta coded (the first delta against 0):
+#   '0'                      dod == 0
+#   '10'   + 7 bits          -63 <= dod <= 64
+#   '110'  + 9 bits          -255 <= dod <= 256
+#   '1110' + 12 bits         -2047 <= dod <= 2048
+#   '1111' + 32 bits         anything else
+#
+# Values are XOR coded against the previous value of the same field: the
+# first value is stored as 64 raw bits, then
+#   '0'                      same as before
+#   '10' + meaningful bits   XOR fits in the previous leading/trailing window
+#   '11' + 6 bits leading zeros + 6 bits length + meaningful bits
+# (6 rather than Gorilla's 5 leading-zero bits: the scaled integers below
+# are small and start with far more than 31 zeros)
+#
+# Sensors report a few decimals, and as float64 such values differ in
+# nearly every mantissa bit from one reading to the next. When all values
+# of a field in a block are exactly n / 10**scale, the XOR runs over the
+# integers n instead; RAW marks a field XOR coded as float64 bit patterns.
+MAGIC = b"GRL1"
+BLOCK = struct.Struct("<IIqqBBB")
+BLOCK_SAMPLES = 256
+RAW = 255
+MAX_SCALE = 4
+MASK64 = (1 << 64) - 1
+FLOAT = struct.Struct("<d")
+BITS = struct.Struct("<Q")
+
+# Smallest decimal scale that represents every value exactly, or RAW
+def _scale(values):
+    for scale in range(MAX_SCALE + 1):
+        factor = 10 ** scale
+        if all(abs(v) < 2 ** 52 / factor and round(v * factor) / factor == v for v in values):
+            return scale
+    return RAW
+
+def _to_bits(value, scale):
+    if scale == RAW:
+        return BITS.unpack(FLOAT.pack(value))[0]
+    return round(value * 10 ** scale) & MASK64
+
+def _from_bits(bits, scale):
+    if scale == RAW:
+        return FLOAT.unpack(BITS.pack(bits))[0]
+    if bits >> 63:
+        bits -= 1 << 64
+    return bits / 10 ** scale
+
+
+class BitWriter:
+    def __init__(self):
+        self.value = 0
+        self.length = 0
+
+    def write(self, bits, length):
+        self.value = (self.value << length) | bits
+        self.length += length
+
+    def getvalue(self):
+        pad = -self.length % 8
+        return (self.value << pad).to_bytes((self.length + pad) // 8, "big")
+
+
+class BitReader:
+    def __init__(self, data):
+        self.value = int.from_bytes(data, "big")
+        self.remaining = len(data) * 8
+
+    def read(self, length):
+        self.remaining -= length
+        return (self.value >> self.remaining) & ((1 << length) - 1)
+
+
+def _encode_block(samples):
+    scales = [_scale([s[i] for s in samples]) for i in (1, 2, 3)]
+    out = BitWriter()
+    previous = [_to_bits(samples[0][i + 1], scales[i]) for i in range(3)]
+    windows = [None, None, None]
+    for bits in previous:
+        out.write(bits, 64)
+    last_ts, last_delta = samples[0][0], 0
+    for sample in samples[1:]:
+        delta = sample[0] - last_ts
+        dod = delta - last_delta
+        if dod == 0:
+            out.write(0, 1)
+        elif -63 <= dod <= 64:
+            out.write(0b10, 2)
+            out.write(dod + 63, 7)
+        elif -255 <= dod <= 256:
+            out.write(0b110, 3)
+            out.write(dod + 255, 9)
+        elif -2047 <= dod <= 2048:
+            out.write(0b1110, 4)
+            out.write(dod + 2047, 12)
+        else:
+            out.write(0b1111, 4)
+            out.write(dod & 0xFFFFFFFF, 32)
+        last_ts, last_delta = sample[0], delta
+
+        for i in range(3):
+            bits = _to_bits(sample[i + 1], scales[i])
+            xor = bits ^ previous[i]
+            previous[i] = bits
+            if xor == 0:
+                out.write(0, 1)
+                continue
+            leading = 64 - xor.bit_length()
+            trailing = (xor & -xor).bit_length() - 1
+            window = windows[i]
+            if window is not None and leading >= window[0] and trailing >= window[1]:
+                out.write(0b10, 2)
+                out.write(xor >> window[1], 64 - window[0] - window[1])
+            else:
+                length = 64 - leading - trailing
+                out.write(0b11, 2)
+                out.write(leading, 6)
+                out.write(length & 63, 6)
+                out.write(xor >> trailing, length)
+                windows[i] = (leading, trailing)
+    payload = out.getvalue()
+    return BLOCK.pack(len(samples), len(payload), samples[0][0], samples[-1][0], *scales) + payload
+
+def _decode_block(header, payload):
+    count, _, first_ts, _, *scales = header
+    bits = BitReader(payload)
+    previous = [bits.read(64) for _ in range(3)]
+    windows = [None, None, None]
+    ts, delta = first_ts, 0
+    yield (ts,) + tuple(_from_bits(previous[i], scales[i]) for i in range(3))
+    for _ in range(count - 1):
+        if not bits.read(1):
+            dod = 0
+        elif not bits.read(1):
+            dod = bits.read(7) - 63
+        elif not bits.read(1):
+            dod = bits.read(9) - 255
+        elif not bits.read(1):
+            dod = bits.read(12) - 2047
+        else:
+            dod = bits.read(32)
+            if dod >> 31:
+                dod -= 1 << 32
+        delta += dod
+        ts += delta
+
+        values = [ts]
+        for i in range(3):
+            if bits.read(1):
+                if bits.read(1):
+                    leading = bits.read(6)
+                    length = bits.read(6) or 64
+                    windows[i] = (leading, 64 - leading - length)
+                leading, trailing = windows[i]
+                previous[i] ^= bits.read(64 - leading - trailing) << trailing
+            values.append(_from_bits(previous[i], scales[i]))
+        yield tuple(values)
+
+# Samples (oldest first) -> file contents
+def encode(samples):
+    parts = [MAGIC]
+    for i in range(0, len(samples), BLOCK_SAMPLES):
+        parts.append(_encode_block(samples[i:i + BLOCK_SAMPLES]))
+    return b"".join(parts)
+
+# Yield the header of every block, with f positioned at its payload
+def _blocks(f):
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError("not a compressed segment")
+    while True:
+        raw = f.read(BLOCK.size)
+        if len(raw) < BLOCK.size:
+            return
+        header = BLOCK.unpack(raw)
+        position = f.tell()
+        yield header
+        f.seek(position + header[1])
+
+# Streaming decoder: yield samples with start <= timestamp < end. Blocks
+# entirely outside the range are skipped by their headers, unread.
+def read(path, start=None, end=None):
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return
+    with f:
+        for header in _blocks(f):
+            count, length, first, last = header[:4]
+            if start is not None and last < start:
+                continue
+            if end is not None and first >= end:
+                return
+            for sample in _decode_block(header, f.read(length)):
+                if start is not None and sample[0] < start:
+                    continue
+                if end is not None and sample[0] >= end:
+                    return
+                yield sample
+
+# (count, first timestamp, last timestamp) of samples with
+# start <= timestamp < end; only blocks straddling a bound are decoded
+def extent(path, start=None, end=None):
+    total, first, last = 0, None, None
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return total, first, last
+    with f:
+        for header in _blocks(f):
+            count, length, lo, hi = header[:4]
+            if (start is not None and hi < start) or (end is not None and lo >= end):
+                continue
+            if (start is None or lo >= start) and (end is None or hi < end):
+                timestamps = (lo, hi)
+            else:
+                timestamps = [s[0] for s in _decode_block(header, f.read(length))
+                              if (start is None or s[0] >= start) and (end is None or s[0] < end)]
+                count = len(timestamps)
+            if count:
+                total += count
+                first = timestamps[0] if first is None else first
+                last = timestamps[-1]
+    return total, first, last
+
+def last_sample(path):
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return None
+    with f:
+        block = None
+        for header in _blocks(f):
+            block = (header, f.tell())
+        if block is None:
+            return None
+        header, position = block
+        f.seek(position)
+        sample = None
+        for sample in _decode_block(header, f.read(header[1])):
+            pass
+        return sample
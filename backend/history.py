@@ -0,0 +1,155 @@
+import json
+
+from .rollups import RESOLUTIONS, bucket_json
+from .storage import to_iso
+
+FIELDS = ("temperature", "humidity", "pressure")
+
+# "temperature,humidity" -> ("temperature", "humidity"); empty means all
+def parse_fields(value):
+    if not value:
+        return FIELDS
+    fields = tuple(f.strip() for f in value.split(",") if f.strip())
+    unknown = [f for f in fields if f not in FIELDS]
+    if unknown or not fields:
+        raise ValueError(f"unknown fields {unknown}, expected some of {list(FIELDS)}")
+    return fields
+
+# Stream {**head, key: [rows...]} as JSON, a chunk of rows at a time, so a
+# long range is never materialized in memory
+def stream_document(head, key, rows, chunk=500):
+    yield json.dumps(head, separators=(",", ":"))[:-1].encode() + b',"' + key.encode() + b'":['
+    pending = []
+    first = True
+    for row in rows:
+        pending.append(row)
+        if len(pending) >= chunk:
+            yield (b"" if first else b",") + json.dumps(pending, separators=(",", ":"))[1:-1].encode()
+            first = False
+            pending = []
+    if pending:
+        yield (b"" if first else b",") + json.dumps(pending, separators=(",", ":"))[1:-1].encode()
+    yield b"]}"
+
+def sample_rows(samples, fields):
+    positions = [FIELDS.index(f) + 1 for f in fields]
+    for sample in samples:
+        row = {"timestamp": to_iso(sample[0])}
+        for field, position in zip(fields, positions):
+            row[field] = sample[position]
+        yield row
+
+# Rollup buckets in the raw sample row shape, using each bucket's average
+def bucket_rows(buckets, fields):
+    offsets = [2 + 5 * FIELDS.index(f) + 2 for f in fields]
+    for bucket in buckets:
+        row = {"timestamp": to_iso(bucket[0])}
+        for field, offset in zip(fields, offsets):
+            row[field] = bucket[offset] / bucket[1]
+        yield row
+
+# Pick the source for a history query with a point budget: raw samples if
+# they fit, otherwise the finest rollup whose bucket count fits. Estimates
+# come from segment indexes and the bucket width over the part of the range
+# that actually holds data, without reading any samples.
+# Returns (resolution, estimated points); resolution is "raw" or a key of
+# RESOLUTIONS.
+def plan_history(store, device_id, start, end, max_points=None):
+    raw, first, last = store.extent(device_id, start, end)
+    if max_points is None or raw <= max_points:
+        return "raw", raw
+    estimate = raw
+    for resolution, width in RESOLUTIONS.items():
+        estimate = min(raw, last // width - first // width + 1)
+        if estimate <= max_points:
+            return resolution, estimate
+    return resolution, estimate
+
+def stream_history(store, rollups, device_id, room, start, end, fields, resolution="raw", estimate=None):
+    head = {
+        "device_id": device_id, "room": room, "from": to_iso(start), "to": to_iso(end),
+        "fields": list(fields), "resolution": resolution, "estimated_points": estimate
+    }
+    if resolution == "raw":
+        rows = sample_rows(store.read(device_id, start, end), fields)
+    else:
+        rows = bucket_rows(rollups.read(device_id, resolution, start, end), fields)
+    return stream_document(head, "samples", rows)
+
+def stream_rollup(rollups, device_id, room, resolution, start, end):
+    head = {"device_id": device_id, "room": room, "resolution": resolution, "from": to_iso(start), "to": to_iso(end)}
+    buckets = rollups.read(device_id, resolution, start, end)
+    return stream_document(head, "buckets", (bucket_json(b) for b in buckets))
+
+
+# Largest-Triangle-Three-Buckets downsampling, done in one streaming pass.
+#
+# [first, last] is cut into points - 2 equal time buckets. A bucket's point
+# is picked once the following bucket is complete (its average is the third
+# triangle corner), so at most two buckets of samples are held at a time.
+# Every field is downsampled on its own and may pick different samples.
+# Returns {field: [(timestamp_ms, value), ...]}.
+def lttb(samples, fields, points, first, last):
+    positions = [FIELDS.index(f) + 1 for f in fields]
+    series = {f: [] for f in fields}
+    width = max(1, (last - first) / max(1, points - 2))
+    anchors = None
+    current, upcoming = [], []
+    current_bucket = upcoming_bucket = None
+
+    def select(bucket, following):
+        count = len(following)
+        corner_t = sum(s[0] for s in following) / count
+        for field, position in zip(fields, positions):
+            anchor_t, anchor_v = anchors[field]
+            corner_v = sum(s[position] for s in following) / count
+            best, best_area = None, -1.0
+            for s in bucket:
+                area = abs((anchor_t - corner_t) * (s[position] - anchor_v)
+                           - (anchor_t - s[0]) * (corner_v - anchor_v))
+                if area > best_area:
+                    best, best_area = s, area
+            series[field].append((best[0], best[position]))
+            anchors[field] = (best[0], best[position])
+
+    for sample in samples:
+        if anchors is None:
+            anchors = {f: (sample[0], sample[p]) for f, p in zip(fields, positions)}
+            for field, position in zip(fields, positions):
+                series[field].append((sample[0], sample[position]))
+            continue
+        index = int((sample[0] - first) / width)
+        if current_bucket is None or index == current_bucket:
+            current_bucket = index
+            current.append(sample)
+        elif upcoming_bucket is None or index == upcoming_bucket:
+            upcoming_bucket = index
+            upcoming.append(sample)
+        else:
+            select(current, upcoming)
+            current, current_bucket = upcoming, upcoming_bucket
+            upcoming, upcoming_bucket = [sample], index
+
+    # The final sample is always kept and closes the last triangle
+    final = (upcoming or current or [None]).pop()
+    if final is None:
+        return series
+    if current and upcoming:
+        select(current, upcoming)
+        current = upcoming
+    if current:
+        select(current, [final])
+    for field, position in zip(fields, positions):
+        series[field].append((final[0], final[position]))
+    return series
+
+def lttb_history(store, device_id, room, start, end, fields, points):
+    count, first, last = store.extent(device_id, start, end)
+    series = {f: [] for f in fields}
+    if count:
+        series = lttb(store.read(device_id, start, end), fields, points, first, last)
+    return {
+        "device_id": device_id, "room": room, "from": to_iso(start), "to": to_iso(end),
+        "fields": list(fields), "resolution": "lttb", "points": points,
+        "series": {f: [[to_iso(t), v] for t, v in values] for f, values in series.items()}
+    }
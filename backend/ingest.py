@@ -0,0 +1,292 @@
+from collections import namedtuple
+import asyncio
+import logging
+import math
+import time
+
+from . import config
+from .storage import now_ms, parse_timestamp
+
+log = logging.getLogger(__name__)
+
+# Seconds clients are asked to wait after a server-side write failure
+FAILURE_RETRY_AFTER = 5
+
+Reading = namedtuple("Reading", "device_id room timestamp temperature humidity pressure")
+
+# Reject device-supplied timestamps too far in the future or already
+# outside the retention window
+def check_timestamp(timestamp, received_at):
+    if timestamp > received_at + config.MAX_CLOCK_SKEW_SECONDS * 1000:
+        raise ValueError("timestamp is in the future")
+    if timestamp < received_at - config.RETENTION_DAYS * 24 * 3600 * 1000:
+        raise ValueError("timestamp is outside the retention window")
+    return timestamp
+
+# Coerce one JSON reading; timestamp is optional and defaults to received_at
+def parse_reading(data, received_at=None):
+    received_at = received_at or now_ms()
+    if data.get("timestamp") is None:
+        timestamp = received_at
+    else:
+        timestamp = check_timestamp(parse_timestamp(data["timestamp"]), received_at)
+    return Reading(
+        int(data["device_id"]),
+        str(data["room"]),
+        timestamp,
+        float(data["temperature"]),
+        float(data["humidity"]),
+        float(data["pressure"])
+    )
+
+# Compact text sample "temperature,humidity,pressure" or
+# "timestamp,temperature,humidity,pressure" (timestamp as in
+# parse_timestamp) for a device whose id and room are already known
+def parse_compact(device_id, room, text, received_at=None):
+    fields = text.split(",")
+    if len(fields) == 3:
+        return parse_reading({
+            "device_id": device_id, "room": room,
+            "temperature": fields[0], "humidity": fields[1], "pressure": fields[2]
+        }, received_at)
+    if len(fields) == 4:
+        return parse_reading({
+            "device_id": device_id, "room": room, "timestamp": fields[0],
+            "temperature": fields[1], "humidity": fields[2], "pressure": fields[3]
+        }, received_at)
+    raise ValueError("expected 3 or 4 comma-separated values")
+
+def ok(index):
+    return {"index": index, "status": "ok"}
+
+def error(index, detail):
+    return {"index": index, "status": "error", "detail": detail}
+
+# Server-side write failure of one item; unlike "error" the reading itself
+# was fine and can be sent again
+def failed(index, detail):
+    return {"index": index, "status": "failed", "detail": detail, "retry_after": FAILURE_RETRY_AFTER}
+
+# Write readings with one store append per device. Returns per-item results
+# and the newest (device_id, room, sample) of every device written, for the
+# caller to apply to the latest table. `newest` carries the newest written
+# timestamp per device across calls that run before the table is updated.
+# Each device's series only moves forward in time, so readings older than
+# the newest one already stored for that device are rejected.
+#
+# sinks are derived views (rollups, caches) with an add(device_id, room,
+# samples) method, fed every group that was written to the store.
+def persist(store, latest, readings, newest=None, sinks=()):
+    newest = {} if newest is None else newest
+    results = [None] * len(readings)
+    updates = []
+    groups = {}
+    for index, reading in enumerate(readings):
+        groups.setdefault(reading.device_id, []).append(index)
+
+    for device_id, indexes in groups.items():
+        indexes.sort(key=lambda i: readings[i].timestamp)
+        last = newest.get(device_id, latest.timestamp(device_id))
+        accepted = []
+        for index in indexes:
+            reading = readings[index]
+            if last is not None and reading.timestamp < last:
+                results[index] = error(index, "timestamp is older than the device's latest reading")
+                continue
+            accepted.append(index)
+            last = reading.timestamp
+        if not accepted:
+            continue
+
+        room = readings[accepted[-1]].room
+        samples = [readings[i][2:] for i in accepted]
+        try:
+            store.append(device_id, room, samples)
+        except OSError as e:
+            log.error("store append for device %s failed: %s", device_id, e)
+            for index in accepted:
+                results[index] = failed(index, f"write failed: {e}")
+            continue
+        for sink in sinks:
+            try:
+                sink.add(device_id, room, samples)
+            except Exception:
+                log.exception("ingest sink %r failed", sink)
+        newest[device_id] = samples[-1][0]
+        updates.append((device_id, room, samples[-1]))
+        for index in accepted:
+            results[index] = ok(index)
+    return results, updates
+
+
+# Raised by IngestQueue.submit when a request is not admitted. status is the
+# HTTP status to answer with, retry_after the suggested wait in seconds.
+class IngestOverloaded(Exception):
+    def __init__(self, status, retry_after, message):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+# Raised by IngestQueue.submit when the writer failed on the server side
+# (e.g. fsync on a full disk). Part of the request may have been written.
+class IngestFailed(IngestOverloaded):
+    def __init__(self, message):
+        super().__init__(503, FAILURE_RETRY_AFTER, message)
+
+
+# Single writer for all ingest paths.
+#
+# Handlers submit() readings and await their per-item results. One writer
+# task drains whatever has queued up, writes it from a worker thread (so no
+# disk I/O runs on the event loop) and acknowledges every request in the
+# batch. Durability modes:
+#
+#   request  fsync after every request, before acknowledging it
+#   batch    one fsync per drained batch (group commit)
+#   none     leave flushing to the OS
+#
+# Admission is bounded: once more than high_water readings are waiting,
+# new requests are turned away with a Retry-After derived from the measured
+# drain rate, so the latency of already admitted requests stays bounded.
+# An optional per-device limiter (see ratelimit.py) can be applied before
+# that.
+class IngestQueue:
+    def __init__(self, store, latest, durability="batch", max_batch=1000, high_water=5000,
+                 limiter=None, sinks=()):
+        if durability not in ("request", "batch", "none"):
+            raise ValueError(f"unknown durability mode {durability!r}")
+        self.store = store
+        self.latest = latest
+        self.durability = durability
+        self.max_batch = max_batch
+        self.high_water = high_water
+        self.limiter = limiter
+        self.sinks = list(sinks)
+        self.queue = asyncio.Queue()
+        self.pending = 0
+        self.running = False
+        self.drain_rate = None
+        self.batches = 0
+        self.written = 0
+        self.last_batch_size = 0
+        self.rejected_requests = 0
+        self.rejected_readings = 0
+
+    # Seconds until the current backlog should have drained
+    def retry_after(self):
+        if not self.drain_rate:
+            return 1
+        return min(60, max(1, math.ceil(self.pending / self.drain_rate)))
+
+    # Per-item results for readings. With limit, the per-device limiter is
+    # applied first and readings it holds back get a "rate_limited" or
+    # "coalesced" result instead of being written. Only the single-reading
+    # paths limit; batches and line protocol carry backfills that must not
+    # be cut short.
+    async def submit(self, readings, limit=False):
+        if limit and self.limiter is not None:
+            admitted, indexes, results = self.limiter.admit(readings)
+            if len(admitted) < len(readings):
+                written = await self._enqueue(admitted) if admitted else []
+                for index, result in zip(indexes, written):
+                    result["index"] = index
+                    results[index] = result
+                return results
+        return await self._enqueue(readings)
+
+    async def _enqueue(self, readings):
+        if not self.running:
+            self._reject(readings)
+            raise IngestOverloaded(503, 5, "ingest writer is not running")
+        if self.pending and self.pending + len(readings) > self.high_water:
+            self._reject(readings)
+            raise IngestOverloaded(429, self.retry_after(), "ingest queue is full")
+        future = asyncio.get_running_loop().create_future()
+        self.pending += len(readings)
+        self.queue.put_nowait((readings, future))
+        return await future
+
+    def _reject(self, readings):
+        self.rejected_requests += 1
+        self.rejected_readings += len(readings)
+
+    def start(self):
+        self.running = True
+        return asyncio.create_task(self.run())
+
+    async def run(self):
+        try:
+            await self._drain()
+        finally:
+            self.running = False
+
+    async def _drain(self):
+        while True:
+            batch = [await self.queue.get()]
+            size = len(batch[0][0])
+            while size < self.max_batch and not self.queue.empty():
+                item = self.queue.get_nowait()
+                batch.append(item)
+                size += len(item[0])
+
+            started = time.perf_counter()
+            try:
+                outcome = await asyncio.to_thread(self._write, [readings for readings, _ in batch])
+            except Exception as e:
+                log.exception("ingest batch failed")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(IngestFailed(f"write failed: {e}"))
+                continue
+            finally:
+                self.pending -= size
+            rate = size / max(time.perf_counter() - started, 1e-6)
+            self.drain_rate = rate if self.drain_rate is None else 0.8 * self.drain_rate + 0.2 * rate
+
+            per_request, updates = outcome
+            for device_id, room, sample in updates:
+                self.latest.update(device_id, room, sample)
+            for (_, future), results in zip(batch, per_request):
+                if not future.done():
+                    future.set_result(results)
+            self.batches += 1
+            self.written += size
+            self.last_batch_size = size
+
+    # Runs in a worker thread
+    def _write(self, requests):
+        if self.durability == "request":
+            per_request, updates, newest = [], [], {}
+            for readings in requests:
+                results, written = persist(self.store, self.latest, readings, newest, self.sinks)
+                self.store.sync()
+                per_request.append(results)
+                updates.extend(written)
+            return per_request, updates
+
+        flat = [reading for readings in requests for reading in readings]
+        results, updates = persist(self.store, self.latest, flat, sinks=self.sinks)
+        if self.durability == "batch":
+            self.store.sync()
+        per_request, offset = [], 0
+        for readings in requests:
+            chunk = results[offset:offset + len(readings)]
+            for index, result in enumerate(chunk):
+                result["index"] = index
+            per_request.append(chunk)
+            offset += len(readings)
+        return per_request, updates
+
+    def stats(self):
+        return {
+            "durability": self.durability,
+            "depth": self.pending,
+            "high_water": self.high_water,
+            "drain_rate": self.drain_rate,
+            "retry_after": self.retry_after(),
+            "rejected_requests": self.rejected_requests,
+            "rejected_readings": self.rejected_readings,
+            "batches": self.batches,
+            "written": self.written,
+            "last_batch_size": self.last_batch_size,
+        }
@@ -0,0 +1,108 @@
+from collections import OrderedDict
+import asyncio
+import hashlib
+import json
+import time
+
+from .storage import to_iso
+
+# In-memory table of the newest reading per device, in the row shape the
+# dashboard renders. Kept current on every save and rebuilt from the store
+# at startup, so /api/latest never touches disk.
+#
+# The encoded response body and its ETag are cached and only rebuilt on the
+# first request after a reading changed the table.
+#
+# Every accepted reading bumps `version`. It starts from the boot time in
+# microseconds, so versions keep increasing across restarts. Each row is
+# JSON-encoded once when it changes; listeners are called with
+# (version, row, encoded row) after each update.
+class LatestTable:
+    def __init__(self):
+        self.rows = {}
+        self.encoded_rows = {}
+        self._timestamps = {}
+        self._encoded = None
+        self.version = time.time_ns() // 1000
+        self.base_version = self.version
+        self.listeners = []
+        # device_id -> version of its last update, least recent first
+        self._changed = OrderedDict()
+        # Set (and replaced) on the next update, for long-polling waiters
+        self._next_update = None
+
+    def load(self, store):
+        for device_id in store.devices():
+            last = store.latest(device_id)
+            if last is not None:
+                self.update(device_id, store.room(device_id), last)
+
+    def timestamp(self, device_id):
+        return self._timestamps.get(device_id)
+
+    # Record a sample; older samples than the one already held are ignored
+    def update(self, device_id, room, sample):
+        timestamp, temperature, humidity, pressure = sample
+        if self._timestamps.get(device_id, timestamp) > timestamp:
+            return False
+        self._timestamps[device_id] = timestamp
+        self.rows[device_id] = {
+            "device_id": device_id,
+            "room": room,
+            "temperature": temperature,
+            "humidity": humidity,
+            "pressure": pressure,
+            "timestamp": to_iso(timestamp)
+        }
+        data = json.dumps(self.rows[device_id], separators=(",", ":")).encode()
+        self.encoded_rows[device_id] = data
+        self._encoded = None
+        self.version += 1
+        self._changed[device_id] = self.version
+        self._changed.move_to_end(device_id)
+        for listener in self.listeners:
+            listener(self.version, self.rows[device_id], data)
+        if self._next_update is not None:
+            self._next_update.set()
+            self._next_update = None
+        return True
+
+    def snapshot(self):
+        return list(self.rows.values())
+
+    # (body bytes, strong ETag) of the current snapshot
+    def encoded(self):
+        if self._encoded is None:
+            body = b"[" + b",".join(self.encoded_rows.values()) + b"]"
+            etag = '"%s"' % hashlib.blake2b(body, digest_size=12).hexdigest()
+            self._encoded = (body, etag)
+        return self._encoded
+
+    # Encoded {"version", "full", "devices"} with the rows updated after
+    # `since`, walking only the changed tail of the update order. Versions
+    # from before this process started, or from the future, get everything.
+    def delta(self, since):
+        full = since < self.base_version or since > self.version
+        changed = []
+        if not full:
+            for device_id, version in reversed(self._changed.items()):
+                if version <= since:
+                    break
+                changed.append(self.encoded_rows[device_id])
+            changed.reverse()
+        else:
+            changed = list(self.encoded_rows.values())
+        return b'{"version":%d,"full":%s,"devices":[%s]}' % (
+            self.version, b"true" if full else b"false", b",".join(changed))
+
+    # delta(since) as soon as there is something newer than since, or after
+    # timeout seconds with whatever there is (possibly nothing)
+    async def wait(self, since, timeout):
+        if since >= self.base_version and since == self.version:
+            if self._next_update is None:
+                self._next_update = asyncio.Event()
+            try:
+                await asyncio.wait_for(self._next_update.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.delta(since)
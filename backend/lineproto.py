@@ -0,0 +1,145 @@
+import re
+
+from .ingest import Reading, check_timestamp
+
+# InfluxDB line protocol ingest.
+#
+#   env,device_id=6161,room=Proteomics\ Lab temperature=30.1,humidity=74.9,pressure=1011.4 1765789020493636000
+#
+# The measurement name is ignored. device_id is required; room falls back
+# to the room the device is already known by. temperature, humidity and
+# pressure are required, other fields are ignored. Lines go straight into
+# Reading tuples without an intermediate dict.
+PRECISIONS = {"ns": 1_000_000, "us": 1_000, "ms": 1, "s": None}
+ESCAPED = re.compile(r"\\([,= ])")
+
+# Split on sep where it is neither backslash-escaped nor inside a double
+# quoted string. Escapes are kept, so the parts can be split again; only
+# used for lines containing a backslash or a quote.
+def _split_escaped(text, sep, maxsplit=-1):
+    parts = []
+    start = i = 0
+    quoted = False
+    while i < len(text):
+        ch = text[i]
+        if ch == "\\":
+            i += 2
+            continue
+        if ch == '"':
+            quoted = not quoted
+        elif ch == sep and not quoted and maxsplit != 0:
+            parts.append(text[start:i])
+            start = i + 1
+            maxsplit -= 1
+        i += 1
+    parts.append(text[start:])
+    return parts
+
+# Tag keys, tag values and field keys escape commas, equals signs and
+# spaces with a backslash
+def _unescape(text):
+    return ESCAPED.sub(r"\1", text) if "\\" in text else text
+
+def _float(value):
+    if value[-1:] in ("i", "u"):
+        value = value[:-1]
+    return float(value)
+
+# One line -> Reading. precision is a key of PRECISIONS.
+def parse_line(line, precision, received_at, room_of):
+    if "\\" in line or '"' in line:
+        split, unescape = _split_escaped, _unescape
+    else:
+        split, unescape = str.split, str
+
+    sections = split(line, " ")
+    if len(sections) == 2:
+        series, field_set = sections
+        timestamp = received_at
+    elif len(sections) == 3:
+        series, field_set, raw_ts = sections
+        divisor = PRECISIONS[precision]
+        timestamp = int(raw_ts) * 1000 if divisor is None else int(raw_ts) // divisor
+        timestamp = check_timestamp(timestamp, received_at)
+    else:
+        raise ValueError("expected measurement,tags fields [timestamp]")
+
+    device_id = room = None
+    for tag in split(series, ",")[1:]:
+        key, value = (split(tag, "=", 1) + [""])[:2]
+        key = unescape(key)
+        if key == "device_id":
+            device_id = int(unescape(value))
+        elif key == "room":
+            room = unescape(value)
+    if device_id is None:
+        raise ValueError("missing device_id tag")
+    if room is None:
+        room = room_of(device_id)
+        if room is None:
+            raise ValueError(f"missing room tag for unknown device {device_id}")
+
+    temperature = humidity = pressure = None
+    for field in split(field_set, ","):
+        key, value = (split(field, "=", 1) + [""])[:2]
+        key = unescape(key)
+        if key == "temperature":
+            temperature = _float(value)
+        elif key == "humidity":
+            humidity = _float(value)
+        elif key == "pressure":
+            pressure = _float(value)
+    if temperature is None or humidity is None or pressure is None:
+        raise ValueError("temperature, humidity and pressure fields are required")
+    return Reading(device_id, room, timestamp, temperature, humidity, pressure)
+
+
+# Incremental parser fed with raw body chunks. Complete lines are parsed as
+# soon as they arrive; a partial trailing line waits for the next chunk.
+class LineParser:
+    def __init__(self, precision, received_at, room_of, max_errors=20):
+        if precision not in PRECISIONS:
+            raise ValueError(f"precision must be one of {list(PRECISIONS)}")
+        self.precision = precision
+        self.received_at = received_at
+        self.room_of = room_of
+        self.max_errors = max_errors
+        self.line_number = 0
+        self.rejected = 0
+        self.errors = []
+        self._rest = b""
+
+    # Parse the complete lines of chunk; returns their Readings and, in a
+    # parallel list, their line numbers
+    def feed(self, chunk):
+        data = self._rest + chunk
+        end = data.rfind(b"\n")
+        if end < 0:
+            self._rest = data
+            return [], []
+        self._rest = data[end + 1:]
+        return self._parse(data[:end].decode().split("\n"))
+
+    # Parse whatever is left once the body has ended
+    def close(self):
+        rest, self._rest = self._rest, b""
+        return self._parse([rest.decode()]) if rest else ([], [])
+
+    def _parse(self, lines):
+        readings, numbers = [], []
+        for line in lines:
+            self.line_number += 1
+            line = line.strip()
+            if not line or line[0] == "#":
+                continue
+            try:
+                readings.append(parse_line(line, self.precision, self.received_at, self.room_of))
+                numbers.append(self.line_number)
+            except Exception as e:
+                self.error(self.line_number, e)
+        return readings, numbers
+
+    def error(self, line_number, detail):
+        self.rejected += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append(f"line {line_number}: {detail}")
@@ -0,0 +1,210 @@
+import asyncio
+from collections import deque
+import json
+
+from starlette.websockets import WebSocketDisconnect
+
+# Server-Sent Events feed of accepted readings.
+#
+# Each update is encoded into an SSE frame once and the same bytes are
+# queued to every client. Frames carry the fleet version as their id; a
+# bounded replay buffer lets a reconnecting client resume from
+# Last-Event-ID, and anyone further behind gets a fresh snapshot instead.
+# A client whose queue fills up is dropped and has to reconnect.
+class EventFeed:
+    def __init__(self, latest, replay=1000, client_queue=256, heartbeat=15):
+        self.latest = latest
+        self.replay = deque(maxlen=replay)
+        self.client_queue = client_queue
+        self.heartbeat = heartbeat
+        self.clients = set()
+        self.published = 0
+        self.dropped = 0
+
+    # LatestTable listener
+    def publish(self, version, row, data):
+        frame = b"id: %d\nevent: reading\ndata: %s\n\n" % (version, data)
+        self.replay.append((version, frame))
+        self.published += 1
+        for queue in list(self.clients):
+            try:
+                queue.put_nowait(frame)
+            except asyncio.QueueFull:
+                self._drop(queue)
+
+    def _drop(self, queue):
+        self.clients.discard(queue)
+        self.dropped += 1
+        # Wake the client's stream so it can end; the sentinel may replace
+        # a frame it was never going to get to anyway
+        while True:
+            try:
+                queue.put_nowait(None)
+                return
+            except asyncio.QueueFull:
+                queue.get_nowait()
+
+    def _snapshot(self):
+        body, _ = self.latest.encoded()
+        return b"id: %d\nevent: snapshot\ndata: %s\n\n" % (self.latest.version, body)
+
+    # Frames to send first: the missed ones if they are all still in the
+    # replay buffer, otherwise a full snapshot
+    def _catch_up(self, last_event_id):
+        if last_event_id is not None and self.replay and last_event_id >= self.replay[0][0] - 1:
+            return [frame for version, frame in self.replay if version > last_event_id]
+        if last_event_id is not None and last_event_id == self.latest.version:
+            return []
+        return [self._snapshot()]
+
+    async def stream(self, last_event_id=None):
+        queue = asyncio.Queue(self.client_queue)
+        self.clients.add(queue)
+        try:
+            yield b"retry: 5000\n\n"
+            for frame in self._catch_up(last_event_id):
+                yield frame
+            while True:
+                try:
+                    frame = await asyncio.wait_for(queue.get(), self.heartbeat)
+                except asyncio.TimeoutError:
+                    yield b": ping\n\n"
+                    continue
+                if frame is None:
+                    return
+                yield frame
+        finally:
+            self.clients.discard(queue)
+
+    def stats(self):
+        return {
+            "clients": len(self.clients),
+            "published": self.published,
+            "dropped_clients": self.dropped,
+            "replay_buffered": len(self.replay),
+        }
+
+
+# One WebSocket dashboard connection: its send queue and subscription filter
+class Subscriber:
+    __slots__ = ("queue", "devices", "rooms")
+
+    def __init__(self, size, devices=(), rooms=()):
+        self.queue = asyncio.Queue(size)
+        self.devices = set(devices)
+        self.rooms = set(rooms)
+
+    def wants(self, row):
+        return ((not self.devices or row["device_id"] in self.devices)
+                and (not self.rooms or row["room"] in self.rooms))
+
+
+# {"devices": [...], "rooms": [...]} of a subscribe message -> (device id
+# set, room set); ValueError unless both are lists (or absent) of device
+# ids and room names
+def parse_subscription(subscribe):
+    devices = subscribe.get("devices") or []
+    rooms = subscribe.get("rooms") or []
+    if not isinstance(devices, list) or not isinstance(rooms, list):
+        raise ValueError("devices and rooms must be lists")
+    if not all(isinstance(r, str) for r in rooms):
+        raise ValueError("rooms must be strings")
+    try:
+        return {int(d) for d in devices}, set(rooms)
+    except TypeError as e:
+        raise ValueError(f"bad device id: {e}")
+
+
+# WebSocket fan-out of accepted readings.
+#
+# Each update frame is built once and the same text is queued to every
+# subscriber whose filter matches. Every subscriber has a bounded queue
+# drained by its own sender task; one that falls behind is disconnected
+# (close code 1013) instead of holding up the hub.
+#
+# Messages: the server sends {"type": "snapshot", "version", "devices"}
+# on connect and after every filter change, then {"type": "reading",
+# "version", "device"} per update. Clients may send
+# {"subscribe": {"devices": [...], "rooms": [...]}}; empty lists mean all.
+class BroadcastHub:
+    def __init__(self, latest, client_queue=64):
+        self.latest = latest
+        self.client_queue = client_queue
+        self.subscribers = set()
+        self.published = 0
+        self.dropped = 0
+
+    # LatestTable listener
+    def publish(self, version, row, data):
+        frame = None
+        for subscriber in list(self.subscribers):
+            if not subscriber.wants(row):
+                continue
+            if frame is None:
+                frame = '{"type":"reading","version":%d,"device":%s}' % (version, data.decode())
+            try:
+                subscriber.queue.put_nowait(frame)
+            except asyncio.QueueFull:
+                self._drop(subscriber)
+        self.published += 1
+
+    def _drop(self, subscriber):
+        self.subscribers.discard(subscriber)
+        self.dropped += 1
+        while True:
+            try:
+                subscriber.queue.put_nowait(None)
+                return
+            except asyncio.QueueFull:
+                subscriber.queue.get_nowait()
+
+    def _snapshot(self, subscriber):
+        rows = [row for row in self.latest.rows.values() if subscriber.wants(row)]
+        return json.dumps({"type": "snapshot", "version": self.latest.version, "devices": rows},
+                          separators=(",", ":"))
+
+    async def _send(self, websocket, subscriber):
+        while True:
+            frame = await subscriber.queue.get()
+            if frame is None:
+                await websocket.close(code=1013)
+                return
+            await websocket.send_text(frame)
+
+    async def serve(self, websocket, devices=(), rooms=()):
+        await websocket.accept()
+        subscriber = Subscriber(self.client_queue, devices, rooms)
+        subscriber.queue.put_nowait(self._snapshot(subscriber))
+        self.subscribers.add(subscriber)
+        sender = asyncio.create_task(self._send(websocket, subscriber))
+        try:
+            while True:
+                message = await websocket.receive_json()
+                subscribe = message.get("subscribe") if isinstance(message, dict) else None
+                if not isinstance(subscribe, dict):
+                    continue
+                subscriber.devices, subscriber.rooms = parse_subscription(subscribe)
+                try:
+                    subscriber.queue.put_nowait(self._snapshot(subscriber))
+                except asyncio.QueueFull:
+                    self._drop(subscriber)
+        except (WebSocketDisconnect, RuntimeError):
+            pass
+        except ValueError:
+            # Not JSON, or a malformed subscription; same close code as bad
+            # query parameters on /ws/live
+            sender.cancel()
+            try:
+                await websocket.close(code=1008)
+            except RuntimeError:
+                pass
+        finally:
+            self.subscribers.discard(subscriber)
+            sender.cancel()
+
+    def stats(self):
+        return {
+            "clients": len(self.subscribers),
+            "published": self.published,
+            "dropped_clients": self.dropped,
+        }
@@ -1,11 +1,26 @@
-from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi import FastAPI, Request, HTTPException, Query, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, FileResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
+from contextlib import asynccontextmanager, suppress
 from pathlib import Path
-from datetime import datetime, timedelta
+import asyncio
+import hmac
 import json
 
-app = FastAPI()
+from . import binfmt, config
+from .columnar import ColumnStore
+from .history import lttb_history, parse_fields, plan_history, stream_history, stream_rollup
+from .ingest import IngestFailed, IngestOverloaded, IngestQueue, Reading, error, parse_compact, parse_reading
+from .latest import LatestTable
+from .lineproto import LineParser
+from .live import BroadcastHub, EventFeed
+from .ratelimit import DeviceRateLimiter
+from .retention import RetentionService
+from .ring import RingStore
+from .rollups import RESOLUTIONS, Rollups
+from .sparklines import SparklineCache, parse_window
+from .storage import SegmentStore, now_ms, parse_timestamp, to_iso
+from .udp import UdpIngest
 
 # Paths
 BASE_DIR = Path(__file__).parent
@@ -13,97 +28,455 @@ DATA_FOLDER = BASE_DIR / "data"
 DATA_FOLDER.mkdir(exist_ok=True)
 FRONTEND_DIST = BASE_DIR / "dist"
 
+# Storage
+if config.STORAGE_BACKEND == "columns":
+    store = ColumnStore(DATA_FOLDER)
+elif config.STORAGE_BACKEND == "ring":
+    store = RingStore(DATA_FOLDER, max(1, int(config.RETENTION_DAYS * 24 * 3600 / config.RING_CADENCE_SECONDS)))
+elif config.STORAGE_BACKEND == "segments":
+    store = SegmentStore(DATA_FOLDER)
+else:
+    raise ValueError(f"unknown STORAGE_BACKEND {config.STORAGE_BACKEND!r}")
+latest_table = LatestTable()
+rollups = Rollups(store)
+sparkline_cache = SparklineCache(store, config.SPARKLINE_WINDOWS.split(","))
+event_feed = EventFeed(
+    latest_table, config.SSE_REPLAY_EVENTS, config.SSE_CLIENT_QUEUE, config.SSE_HEARTBEAT_SECONDS
+)
+broadcast_hub = BroadcastHub(latest_table, config.WS_CLIENT_QUEUE)
+rate_limiter = None
+if config.RATE_LIMIT_PER_MINUTE > 0:
+    rate_limiter = DeviceRateLimiter(
+        config.RATE_LIMIT_PER_MINUTE / 60, config.RATE_LIMIT_BURST, config.RATE_LIMIT_POLICY
+    )
+ingest_queue = IngestQueue(
+    store, latest_table,
+    config.INGEST_DURABILITY, config.INGEST_MAX_BATCH, config.INGEST_HIGH_WATER,
+    rate_limiter, [rollups, sparkline_cache]
+)
+udp_ingest = UdpIngest(ingest_queue, store.room, config.UDP_RATE_PER_MINUTE / 60, config.UDP_BURST)
+retention = RetentionService(
+    [store, rollups], config.RETENTION_DAYS, config.RETENTION_INTERVAL_SECONDS, bool(config.SEAL_SEGMENTS)
+)
+
+# Startup / shutdown
+@asynccontextmanager
+async def lifespan(app):
+    await asyncio.to_thread(store.migrate_legacy)
+    await asyncio.to_thread(latest_table.load, store)
+    latest_table.listeners.append(event_feed.publish)
+    latest_table.listeners.append(broadcast_hub.publish)
+    await asyncio.to_thread(rollups.load)
+    tasks = [
+        asyncio.create_task(retention.run_forever()),
+        ingest_queue.start(),
+    ]
+    if rate_limiter is not None and rate_limiter.policy == "coalesce":
+        tasks.append(asyncio.create_task(rate_limiter.run(ingest_queue)))
+    if config.UDP_INGEST_PORT:
+        await asyncio.get_running_loop().create_datagram_endpoint(
+            lambda: udp_ingest, local_addr=(config.UDP_INGEST_HOST, config.UDP_INGEST_PORT)
+        )
+    try:
+        yield
+    finally:
+        if udp_ingest.transport is not None:
+            udp_ingest.transport.close()
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            with suppress(asyncio.CancelledError):
+                await task
+        await asyncio.to_thread(store.close)
+
+app = FastAPI(lifespan=lifespan)
+
 # Serve frontend assets
 if FRONTEND_DIST.exists():
     app.mount("/assets", StaticFiles(directory=FRONTEND_DIST / "assets"), name="assets")
 
 # Save device data
-def save_device_data(device_id, room, temperature, humidity, pressure):
-    file_path = DATA_FOLDER / f"{device_id}.json"
-
-    if file_path.exists():
-        with open(file_path, "r") as f:
-            try:
-                data_json = json.load(f)
-            except:
-                data_json = {"device_id": device_id, "room": room, "data": []}
-    else:
-        data_json = {"device_id": device_id, "room": room, "data": []}
-
-    data_json["room"] = room
-    data_json["device_id"] = device_id
-    data_json["data"].append({
-        "timestamp": datetime.utcnow().isoformat(),
-        "temperature": temperature,
-        "humidity": humidity,
-        "pressure": pressure
-    })
-
-    with open(file_path, "w") as f:
-        json.dump(data_json, f, indent=2)
-
-# Cleanup old data (14 days)
-def cleanup_old_data():
-    now = datetime.utcnow()
-    for file in DATA_FOLDER.glob("*.json"):
-        try:
-            with open(file, "r") as f:
-                data_json = json.load(f)
+async def save_device_data(device_id, room, temperature, humidity, pressure, timestamp=None):
+    reading = Reading(device_id, room, timestamp or now_ms(), temperature, humidity, pressure)
+    result = (await ingest_queue.submit([reading], limit=True))[0]
+    if result["status"] == "rate_limited":
+        raise IngestOverloaded(429, result["retry_after"], "device is over its rate limit")
+    if result["status"] == "failed":
+        raise IngestFailed(result["detail"])
+    if result["status"] == "error":
+        raise ValueError(result["detail"])
+    return result["status"]
 
-            data_json["data"] = [
-                d for d in data_json.get("data", [])
-                if datetime.fromisoformat(d["timestamp"]) >= now - timedelta(days=14)
-            ]
+# 429/503 answer for a request the ingest queue did not admit
+def overloaded(e):
+    return HTTPException(
+        status_code=e.status,
+        detail=str(e),
+        headers={"Retry-After": str(e.retry_after)}
+    )
 
-            with open(file, "w") as f:
-                json.dump(data_json, f, indent=2)
-        except:
-            continue
+# Bodies sent as application/octet-stream are binfmt packets
+def is_binary(request):
+    return request.headers.get("content-type", "").split(";")[0].strip() == "application/octet-stream"
 
-# Receive ESP data
+# Receive ESP data, as JSON or as a binfmt packet holding one record
 @app.post("/api/update")
 async def update_device(request: Request):
     try:
-        data = await request.json()
-        save_device_data(
-            int(data["device_id"]),
-            str(data["room"]),
-            float(data["temperature"]),
-            float(data["humidity"]),
-            float(data["pressure"])
+        if is_binary(request):
+            readings = binfmt.decode(await request.body(), store.room, now_ms())
+            if len(readings) != 1:
+                raise ValueError("expected exactly one record, use /api/update/batch for more")
+            reading = readings[0]
+        else:
+            reading = parse_reading(await request.json())
+        status = await save_device_data(
+            reading.device_id,
+            reading.room,
+            reading.temperature,
+            reading.humidity,
+            reading.pressure,
+            reading.timestamp
         )
+    except IngestOverloaded as e:
+        raise overloaded(e)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Invalid data format: {e}")
 
-    cleanup_old_data()
+    if status == "coalesced":
+        return JSONResponse({"status": "coalesced"}, status_code=202)
     return {"status": "success"}
 
-# Return latest data (✅ corrected format)
-@app.get("/api/latest")
-async def latest():
-    devices = []
-    for file in DATA_FOLDER.glob("*.json"):
+# Receive many readings (e.g. from a gateway) in one request, as a JSON
+# array or as a binfmt packet
+@app.post("/api/update/batch")
+async def update_batch(request: Request):
+    try:
+        if is_binary(request):
+            room, items = binfmt.unpack(await request.body())
+            items = list(items)
+            parse = lambda item, received_at: binfmt.to_reading(item, room, store.room, received_at)
+        else:
+            items = await request.json()
+            parse = parse_reading
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid data format: {e}")
+    if not isinstance(items, list):
+        raise HTTPException(status_code=400, detail="Invalid data format: expected a JSON array")
+    if len(items) > config.MAX_BATCH_READINGS:
+        raise HTTPException(status_code=413, detail=f"At most {config.MAX_BATCH_READINGS} readings per batch")
+
+    received_at = now_ms()
+    results = [None] * len(items)
+    readings, positions = [], []
+    for index, item in enumerate(items):
         try:
-            with open(file) as f:
-                data_json = json.load(f)
+            readings.append(parse(item, received_at))
+            positions.append(index)
+        except Exception as e:
+            results[index] = error(index, f"Invalid data format: {e}")
+
+    try:
+        written = await ingest_queue.submit(readings) if readings else []
+    except IngestOverloaded as e:
+        raise overloaded(e)
+    for position, result in zip(positions, written):
+        result["index"] = position
+        results[position] = result
+
+    accepted = sum(1 for r in results if r["status"] in ("ok", "coalesced"))
+    body = {
+        "status": "success" if accepted == len(results) else "partial" if accepted else "error",
+        "accepted": accepted,
+        "rejected": len(results) - accepted,
+        "results": results
+    }
+    # Nothing stored and the server is to blame: ask for the batch again
+    failures = [r for r in results if r["status"] == "failed"]
+    if failures and not accepted:
+        return JSONResponse(body, status_code=503, headers={"Retry-After": str(failures[0]["retry_after"])})
+    return body
+
+# Receive InfluxDB line protocol (e.g. from Telegraf), one reading per line:
+#   env,device_id=6161,room=Proteomics\ Lab temperature=30.1,humidity=74.9,pressure=1011.4 1765789020493636000
+# The body is parsed as it streams in and handed to the ingest queue in
+# chunks of at most INGEST_MAX_BATCH readings. Answers 204 when every line
+# was stored, like InfluxDB does.
+#
+# Once a chunk has been stored, a full queue is waited out inside the
+# request (for up to LINE_PROTOCOL_RETRY_SECONDS) rather than answered with
+# 429, because a client resending the whole body would then collide with
+# the lines already stored. If the wait runs out, the answer says up to
+# which line the body was stored.
+@app.post("/api/write")
+async def write_lines(request: Request, precision: str = "ns"):
+    try:
+        parser = LineParser(precision, now_ms(), store.room)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    deadline = asyncio.get_running_loop().time() + config.LINE_PROTOCOL_RETRY_SECONDS
+    accepted = 0
+    stored_through = 0
+
+    async def submit(readings, numbers):
+        nonlocal accepted, stored_through
+        for i in range(0, len(readings), config.INGEST_MAX_BATCH):
+            chunk = readings[i:i + config.INGEST_MAX_BATCH]
+            while True:
+                try:
+                    results = await ingest_queue.submit(chunk)
+                    break
+                except IngestOverloaded as e:
+                    if isinstance(e, IngestFailed) or not stored_through:
+                        raise
+                    if asyncio.get_running_loop().time() + e.retry_after > deadline:
+                        raise
+                    await asyncio.sleep(e.retry_after)
+            failure = None
+            for number, result in zip(numbers[i:i + config.INGEST_MAX_BATCH], results):
+                if result["status"] in ("ok", "coalesced"):
+                    accepted += 1
+                else:
+                    parser.error(number, result["detail"])
+                    if result["status"] == "failed":
+                        failure = result["detail"]
+            if failure is not None:
+                raise IngestFailed(failure)
+            stored_through = numbers[i + len(chunk) - 1]
+
+    pending, pending_numbers = [], []
+    try:
+        async for data in request.stream():
+            readings, numbers = parser.feed(data)
+            pending += readings
+            pending_numbers += numbers
+            if len(pending) >= config.INGEST_MAX_BATCH:
+                await submit(pending, pending_numbers)
+                pending, pending_numbers = [], []
+        readings, numbers = parser.close()
+        await submit(pending + readings, pending_numbers + numbers)
+    except IngestOverloaded as e:
+        return JSONResponse(
+            {"detail": str(e), "accepted": accepted, "rejected": parser.rejected,
+             "stored_through_line": stored_through, "errors": parser.errors},
+            status_code=e.status,
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    except UnicodeDecodeError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid data format: {e}")
 
-            if not data_json.get("data"):
+    if parser.rejected:
+        return JSONResponse(
+            {"accepted": accepted, "rejected": parser.rejected, "errors": parser.errors},
+            status_code=400
+        )
+    return Response(status_code=204)
+
+# True if an If-None-Match header value matches etag
+def etag_matches(header, etag):
+    if not header:
+        return False
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+# Persistent ingest connection for a device.
+#
+# The first message identifies the device once:
+#   {"device_id": 6161, "room": "Proteomics Lab", "token": "..."}
+# and is answered with "ready". After that every text frame is one
+# sample, "temperature,humidity,pressure" or
+# "timestamp,temperature,humidity,pressure", answered in order with one of
+# "ok", "coalesced", "limited <seconds>", "busy <seconds>" or
+# "error <detail>".
+@app.websocket("/ws/ingest")
+async def ingest_socket(websocket: WebSocket):
+    await websocket.accept()
+    try:
+        hello = json.loads(await websocket.receive_text())
+        device_id, room = int(hello["device_id"]), str(hello["room"])
+        token = str(hello.get("token", ""))
+    except WebSocketDisconnect:
+        return
+    except Exception:
+        await websocket.close(code=1008, reason="expected device_id and room")
+        return
+    if config.INGEST_TOKEN and not hmac.compare_digest(token, config.INGEST_TOKEN):
+        await websocket.close(code=1008, reason="bad token")
+        return
+    await websocket.send_text("ready")
+
+    try:
+        while True:
+            text = await websocket.receive_text()
+            try:
+                reading = parse_compact(device_id, room, text)
+                result = (await ingest_queue.submit([reading], limit=True))[0]
+            except IngestOverloaded as e:
+                await websocket.send_text(f"busy {e.retry_after}")
+                continue
+            except Exception as e:
+                await websocket.send_text(f"error {e}")
                 continue
+            if result["status"] == "rate_limited":
+                await websocket.send_text(f"limited {result['retry_after']}")
+            elif result["status"] == "failed":
+                await websocket.send_text(f"busy {result['retry_after']}")
+            elif result["status"] == "error":
+                await websocket.send_text(f"error {result['detail']}")
+            else:
+                await websocket.send_text(result["status"])
+    except WebSocketDisconnect:
+        pass
+
+# Return latest data (✅ corrected format)
+# With ?since=<version> only the devices updated after that version are
+# returned, wrapped as {"version", "full", "devices"}.
+@app.get("/api/latest")
+async def latest(request: Request, since: int = None):
+    if since is not None:
+        return Response(content=latest_table.delta(since), media_type="application/json",
+                        headers={"Cache-Control": "no-cache"})
+    body, etag = latest_table.encoded()
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
-            last = data_json["data"][-1]
+# Long-poll variant of /api/latest?since=: held open until a newer reading
+# is accepted or timeout seconds pass
+@app.get("/api/latest/wait")
+async def latest_wait(since: int, timeout: float = Query(30, ge=0, le=60)):
+    body = await latest_table.wait(since, timeout)
+    return Response(content=body, media_type="application/json", headers={"Cache-Control": "no-cache"})
 
-            devices.append({
-                "device_id": data_json["device_id"],
-                "room": data_json["room"],
-                "temperature": last["temperature"],
-                "humidity": last["humidity"],
-                "pressure": last["pressure"],
-                "timestamp": last["timestamp"]
-            })
-        except:
-            continue
+# Push accepted readings to dashboards as Server-Sent Events
+@app.get("/api/stream")
+async def stream(request: Request):
+    try:
+        last_event_id = int(request.headers.get("last-event-id", ""))
+    except ValueError:
+        last_event_id = None
+    return StreamingResponse(
+        event_feed.stream(last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# Push accepted readings over a WebSocket, optionally filtered, e.g.
+# /ws/live?devices=6161,31748 or /ws/live?rooms=Proteomics%20Lab
+@app.websocket("/ws/live")
+async def live(websocket: WebSocket, devices: str = "", rooms: str = ""):
+    try:
+        device_ids = [int(d) for d in devices.split(",") if d.strip()]
+    except ValueError:
+        await websocket.close(code=1008)
+        return
+    room_names = [r.strip() for r in rooms.split(",") if r.strip()]
+    await broadcast_hub.serve(websocket, device_ids, room_names)
+
+# from/to query parameters -> (start_ms, end_ms); defaults to the whole
+# retention window
+def parse_range(start, end):
+    try:
+        end_ms = parse_timestamp(end) if end else now_ms() + config.MAX_CLOCK_SKEW_SECONDS * 1000
+        start_ms = parse_timestamp(start) if start else end_ms - config.RETENTION_DAYS * 24 * 3600 * 1000
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid time range: {e}")
+    if start_ms >= end_ms:
+        raise HTTPException(status_code=400, detail="Invalid time range: from must be before to")
+    return start_ms, end_ms
+
+def known_room(device_id):
+    room = store.room(device_id)
+    if room is None:
+        raise HTTPException(status_code=404, detail=f"Unknown device {device_id}")
+    return room
+
+# Samples of one device in a time range. With max_points the server picks
+# raw samples or the finest rollup that stays within the budget;
+# downsample=lttb instead returns per-field series of at most `points`
+# visually representative samples.
+@app.get("/api/devices/{device_id}/history")
+async def device_history(
+    device_id: int,
+    start: str = Query(None, alias="from"),
+    end: str = Query(None, alias="to"),
+    fields: str = None,
+    max_points: int = Query(None, ge=1),
+    downsample: str = None,
+    points: int = Query(300, ge=3, le=10000)
+):
+    room = known_room(device_id)
+    start_ms, end_ms = parse_range(start, end)
+    try:
+        fields = parse_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if downsample == "lttb":
+        return await asyncio.to_thread(lttb_history, store, device_id, room, start_ms, end_ms, fields, points)
+    if downsample is not None:
+        raise HTTPException(status_code=400, detail="Unknown downsample mode, expected lttb")
+    resolution, estimate = await asyncio.to_thread(plan_history, store, device_id, start_ms, end_ms, max_points)
+    return StreamingResponse(
+        stream_history(store, rollups, device_id, room, start_ms, end_ms, fields, resolution, estimate),
+        media_type="application/json"
+    )
+
+# Sample count and min/max/avg of every field of one device over a range
+@app.get("/api/devices/{device_id}/summary")
+async def device_summary(
+    device_id: int,
+    start: str = Query(None, alias="from"),
+    end: str = Query(None, alias="to")
+):
+    room = known_room(device_id)
+    start_ms, end_ms = parse_range(start, end)
+    result = await asyncio.to_thread(store.aggregate, device_id, start_ms, end_ms)
+    return {"device_id": device_id, "room": room, "from": to_iso(start_ms), "to": to_iso(end_ms), **result}
+
+# Precomputed min/max/avg/first/last buckets of one device
+@app.get("/api/devices/{device_id}/rollup")
+async def device_rollup(
+    device_id: int,
+    resolution: str = "1h",
+    start: str = Query(None, alias="from"),
+    end: str = Query(None, alias="to")
+):
+    room = known_room(device_id)
+    if resolution not in RESOLUTIONS:
+        raise HTTPException(status_code=400, detail=f"Unknown resolution, expected one of {list(RESOLUTIONS)}")
+    start_ms, end_ms = parse_range(start, end)
+    return StreamingResponse(
+        stream_rollup(rollups, device_id, room, resolution, start_ms, end_ms),
+        media_type="application/json"
+    )
+
+# Recent trend of every device in one response, for dashboard sparklines
+@app.get("/api/sparklines")
+async def sparklines(window: str = "24h", points: int = Query(96, ge=2, le=500)):
+    try:
+        window_ms = parse_window(window)
+        sparkline_cache.check(window_ms, points)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if window_ms > config.RETENTION_DAYS * 24 * 3600 * 1000:
+        raise HTTPException(status_code=400, detail="window is longer than the retention period")
+    return await asyncio.to_thread(sparkline_cache.get, window_ms, points)
 
-    return devices
+# Server-side counters
+@app.get("/api/stats")
+async def stats():
+    return {
+        "retention": retention.stats(),
+        "ingest": ingest_queue.stats(),
+        "rate_limit": rate_limiter.stats() if rate_limiter else None,
+        "stream": event_feed.stats(),
+        "websocket": broadcast_hub.stats(),
+        "udp": udp_ingest.stats() if config.UDP_INGEST_PORT else None
+    }
 
 # Serve frontend
 @app.get("/")
@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import math
+import time
+
+from .ingest import IngestOverloaded
+
+log = logging.getLogger(__name__)
+
+# Token buckets keyed by an arbitrary hashable (device id, source address).
+#
+# Each entry is a two-item list [tokens, updated_at]. An entry that has been
+# idle long enough to refill completely is indistinguishable from a fresh
+# one, so sweep() drops those and the table only holds recently active keys.
+class TokenBuckets:
+    def __init__(self, rate, burst, sweep_interval=60):
+        self.rate = rate
+        self.burst = burst
+        self.sweep_interval = sweep_interval
+        self._buckets = {}
+        self._last_sweep = time.monotonic()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def _refill(self, key, now):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [self.burst, now]
+        else:
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        return bucket
+
+    # Take one token; False if the bucket is empty
+    def take(self, key):
+        now = time.monotonic()
+        if now - self._last_sweep >= self.sweep_interval:
+            self.sweep(now)
+        bucket = self._refill(key, now)
+        if bucket[0] < 1:
+            return False
+        bucket[0] -= 1
+        return True
+
+    # Seconds until key has a token again
+    def wait_time(self, key):
+        bucket = self._refill(key, time.monotonic())
+        return max(0.0, (1 - bucket[0]) / self.rate)
+
+    def sweep(self, now=None):
+        now = time.monotonic() if now is None else now
+        self._last_sweep = now
+        full_after = self.burst / self.rate
+        idle = [key for key, (_, updated) in self._buckets.items() if now - updated >= full_after]
+        for key in idle:
+            del self._buckets[key]
+        return len(idle)
+
+
+# Per-device limit on the single-reading ingest paths. Readings over the
+# limit are either rejected or, with the "coalesce" policy, parked so that
+# only the newest one per device is written once the device has a token
+# again.
+class DeviceRateLimiter:
+    def __init__(self, rate, burst, policy="reject"):
+        if policy not in ("reject", "coalesce"):
+            raise ValueError(f"unknown rate limit policy {policy!r}")
+        self.buckets = TokenBuckets(rate, burst)
+        self.policy = policy
+        self.parked = {}
+        self.limited = 0
+        self.coalesced = 0
+        self.flushed = 0
+
+    # Split readings into those admitted now and per-item results for the
+    # rest. Returns (admitted readings, their indexes, results), where
+    # results holds None at admitted positions.
+    def admit(self, readings):
+        admitted, indexes = [], []
+        results = [None] * len(readings)
+        for index, reading in enumerate(readings):
+            device_id = reading.device_id
+            if self.buckets.take(device_id):
+                # Anything parked for this device is older; drop it
+                self.parked.pop(device_id, None)
+                admitted.append(reading)
+                indexes.append(index)
+            elif self.policy == "coalesce":
+                parked = self.parked.get(device_id)
+                if parked is None or parked.timestamp <= reading.timestamp:
+                    self.parked[device_id] = reading
+                self.coalesced += 1
+                results[index] = {"index": index, "status": "coalesced"}
+            else:
+                self.limited += 1
+                results[index] = {
+                    "index": index,
+                    "status": "rate_limited",
+                    "retry_after": math.ceil(self.buckets.wait_time(device_id)),
+                }
+        return admitted, indexes, results
+
+    # Parked readings whose device has a token again
+    def due(self):
+        ready = [device_id for device_id in self.parked if self.buckets.take(device_id)]
+        return [self.parked.pop(device_id) for device_id in ready]
+
+    # Periodically hand due parked readings to the ingest queue
+    async def run(self, ingest, interval=1.0):
+        while True:
+            await asyncio.sleep(interval)
+            readings = self.due()
+            if not readings:
+                continue
+            try:
+                await ingest.submit(readings)
+                self.flushed += len(readings)
+            except IngestOverloaded:
+                log.warning("dropped %d coalesced readings, ingest queue is full", len(readings))
+
+    def stats(self):
+        return {
+            "policy": self.policy,
+            "rate_per_second": self.buckets.rate,
+            "burst": self.buckets.burst,
+            "tracked": len(self.buckets),
+            "parked": len(self.parked),
+            "limited": self.limited,
+            "coalesced": self.coalesced,
+            "flushed": self.flushed,
+        }
@@ -0,0 +1,66 @@
+import asyncio
+import logging
+import time
+
+from .storage import now_ms, segment_start, to_iso
+
+log = logging.getLogger(__name__)
+
+# Background retention: drops data older than the retention window on a
+# fixed interval, off the ingest path. stores are anything with a
+# drop_before(cutoff_ms) method returning the bytes it reclaimed. With seal,
+# stores that have a seal(before_ms) method also get the days before today
+# compressed; it returns the bytes saved.
+class RetentionService:
+    def __init__(self, stores, days, interval, seal=False):
+        self.stores = stores
+        self.window_ms = days * 24 * 3600 * 1000
+        self.interval = interval
+        self.seal = seal
+        self.runs = 0
+        self.last_run_at = None
+        self.last_duration = None
+        self.last_reclaimed = 0
+        self.total_reclaimed = 0
+        self.last_sealed = 0
+        self.total_sealed = 0
+        self.last_error = None
+
+    def run_once(self):
+        started = time.perf_counter()
+        reclaimed = sealed = 0
+        try:
+            now = now_ms()
+            reclaimed = sum(store.drop_before(now - self.window_ms) for store in self.stores)
+            if self.seal:
+                sealed = sum(store.seal(segment_start(now)) for store in self.stores if hasattr(store, "seal"))
+            self.last_error = None
+        except Exception as e:
+            log.exception("retention run failed")
+            self.last_error = str(e)
+        self.runs += 1
+        self.last_run_at = to_iso(now_ms())
+        self.last_duration = time.perf_counter() - started
+        self.last_reclaimed = reclaimed
+        self.total_reclaimed += reclaimed
+        self.last_sealed = sealed
+        self.total_sealed += sealed
+        return reclaimed
+
+    async def run_forever(self):
+        while True:
+            await asyncio.to_thread(self.run_once)
+            await asyncio.sleep(self.interval)
+
+    def stats(self):
+        return {
+            "interval_seconds": self.interval,
+            "runs": self.runs,
+            "last_run_at": self.last_run_at,
+            "last_duration_seconds": self.last_duration,
+            "last_reclaimed_bytes": self.last_reclaimed,
+            "total_reclaimed_bytes": self.total_reclaimed,
+            "last_sealed_saved_bytes": self.last_sealed,
+            "total_sealed_saved_bytes": self.total_sealed,
+            "last_error": self.last_error,
+        }
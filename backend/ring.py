@@ -0,0 +1,243 @@
+from bisect import bisect_left
+from heapq import merge
+import mmap
+import os
+import struct
+import zlib
+
+from .storage import SegmentStore, narrow
+
+MAGIC = b"RNG2"
+# magic, slot size, capacity in slots, head and tail as absolute sample
+# numbers: the ring holds samples tail..head-1, sample n in slot n % capacity
+HEADER = struct.Struct("<4sIQQQ")
+HEADER_SIZE = 64
+RECORD = struct.Struct("<qfff")
+CRC = struct.Struct("<I")
+NUMBER = struct.Struct("<Q")
+SLOT_SIZE = RECORD.size + CRC.size
+
+
+# One device's preallocated ring file, mapped into memory.
+#
+# Writing n samples first moves the tail past the slots about to be
+# overwritten, then fills the slots, then moves the head. Every slot
+# carries a crc32 of its sample number and record, so neither a
+# half-written slot nor one still holding the sample from a lap earlier
+# (mapped pages reach the disk in any order) passes as the sample the
+# header says is there. Such slots are skipped on read, and a ring that
+# has any is rebuilt from its good slots when it is opened.
+class Ring:
+    def __init__(self, path, capacity):
+        self.path = path
+        exists = path.exists()
+        self.file = open(path, "r+b" if exists else "w+b")
+        if not exists:
+            self.file.truncate(HEADER_SIZE + capacity * SLOT_SIZE)
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        magic, slot_size, self.capacity, self.head, self.tail = HEADER.unpack_from(self.map)
+        if magic != MAGIC or slot_size != SLOT_SIZE:
+            self.capacity, self.head, self.tail = capacity, 0, 0
+            self._write_header()
+
+    def _write_header(self):
+        HEADER.pack_into(self.map, 0, MAGIC, SLOT_SIZE, self.capacity, self.head, self.tail)
+
+    def _offset(self, n):
+        return HEADER_SIZE + (n % self.capacity) * SLOT_SIZE
+
+    def timestamp(self, n):
+        return struct.unpack_from("<q", self.map, self._offset(n))[0]
+
+    def append(self, samples):
+        samples = samples[-self.capacity:]
+        head = self.head + len(samples)
+        if head - self.capacity > self.tail:
+            self.tail = head - self.capacity
+            self._write_header()
+        for n, sample in enumerate(samples, self.head):
+            offset = self._offset(n)
+            RECORD.pack_into(self.map, offset, *sample)
+            CRC.pack_into(self.map, offset + RECORD.size, _checksum(n, self.map[offset:offset + RECORD.size]))
+        self.head = head
+        self._write_header()
+
+    # Move the tail past samples older than cutoff; returns how many
+    def drop_before(self, cutoff):
+        tail = self.bounds(cutoff)[0]
+        dropped = tail - self.tail
+        if dropped:
+            self.tail = tail
+            self._write_header()
+        return dropped
+
+    # Absolute sample numbers [lo, hi) with start <= timestamp < end
+    def bounds(self, start=None, end=None):
+        numbers = range(self.tail, self.head)
+        lo = 0 if start is None else bisect_left(numbers, start, key=self.timestamp)
+        hi = len(numbers) if end is None else bisect_left(numbers, end, key=self.timestamp)
+        return self.tail + lo, self.tail + max(lo, hi)
+
+    # Raw slots of samples lo..hi-1, copied out of the map
+    def slots(self, lo, hi):
+        if hi <= lo:
+            return b""
+        first, last = self._offset(lo), self._offset(hi - 1) + SLOT_SIZE
+        if first < last:
+            return self.map[first:last]
+        return self.map[first:] + self.map[HEADER_SIZE:last]
+
+    def flush(self):
+        self.map.flush()
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+def _checksum(n, record):
+    return zlib.crc32(record, zlib.crc32(NUMBER.pack(n)))
+
+# Decode the raw slots of samples first, first + 1, ..., skipping any whose
+# checksum does not match
+def decode_slots(data, first):
+    view = memoryview(data)
+    for n, offset in enumerate(range(0, len(data), SLOT_SIZE), first):
+        record = view[offset:offset + RECORD.size]
+        if _checksum(n, record) != CRC.unpack_from(view, offset + RECORD.size)[0]:
+            continue
+        ts, temperature, humidity, pressure = RECORD.unpack(record)
+        yield ts, narrow(temperature), narrow(humidity), narrow(pressure)
+
+
+# Per-device fixed-capacity ring store.
+#
+#   data/{device_id}/meta.json   as in SegmentStore
+#   data/{device_id}/ring.dat    64-byte header, then `capacity` 24-byte
+#                                slots (int64 ms, 3 x float32, crc32)
+#
+# The ring is sized for the retention window at the expected cadence, so a
+# new sample simply overwrites the oldest one and the file never grows.
+# Retention only moves the tail past expired samples, for devices that
+# report slower than expected or not at all any more. A ring found with another
+# capacity, or with slots that fail their checksum, is rebuilt at the
+# configured capacity from its good slots, keeping the newest.
+# Same interface as SegmentStore; select it with STORAGE_BACKEND=ring.
+class RingStore(SegmentStore):
+    def __init__(self, folder, capacity):
+        super().__init__(folder)
+        self.capacity = capacity
+        self._rings = {}
+
+    def ring_path(self, device_id):
+        return self.device_dir(device_id) / "ring.dat"
+
+    # Open ring of a device, or None if it has none yet; call with _lock held
+    def _ring(self, device_id, create=False):
+        ring = self._rings.get(device_id)
+        if ring is not None:
+            return ring
+        path = self.ring_path(device_id)
+        if not create and not path.exists():
+            return None
+        ring = Ring(path, self.capacity)
+        samples = list(decode_slots(ring.slots(ring.tail, ring.head), ring.tail))
+        if ring.capacity != self.capacity or len(samples) != ring.head - ring.tail:
+            ring.close()
+            ring = self._rebuild(path, samples)
+        self._rings[device_id] = ring
+        return ring
+
+    # Replace the ring file with a fresh one holding samples
+    def _rebuild(self, path, samples):
+        tmp = path.with_suffix(".tmp")
+        tmp.unlink(missing_ok=True)
+        ring = Ring(tmp, self.capacity)
+        ring.append(samples)
+        ring.flush()
+        ring.close()
+        os.replace(tmp, path)
+        return Ring(path, self.capacity)
+
+    def append(self, device_id, room, samples):
+        with self._lock:
+            self._set_room(device_id, room)
+            self._ring(device_id, create=True).append(samples)
+            self._dirty.add(device_id)
+
+    def sync(self):
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            for device_id in dirty:
+                self._rings[device_id].flush()
+
+    def close(self):
+        with self._lock:
+            for ring in self._rings.values():
+                ring.flush()
+                ring.close()
+            self._rings.clear()
+            self._dirty.clear()
+
+    # The matching slots are copied out under the lock, so a concurrent
+    # append cannot overwrite them halfway through the read
+    def read(self, device_id, start=None, end=None):
+        with self._lock:
+            ring = self._ring(device_id)
+            lo, hi = ring.bounds(start, end) if ring is not None else (0, 0)
+            data = ring.slots(lo, hi) if ring is not None else b""
+        yield from decode_slots(data, lo)
+
+    def extent(self, device_id, start=None, end=None):
+        with self._lock:
+            ring = self._ring(device_id)
+            if ring is None:
+                return 0, None, None
+            lo, hi = ring.bounds(start, end)
+            if hi <= lo:
+                return 0, None, None
+            return hi - lo, ring.timestamp(lo), ring.timestamp(hi - 1)
+
+    def latest(self, device_id):
+        with self._lock:
+            ring = self._ring(device_id)
+            if ring is None:
+                return None
+            for n in range(ring.head - 1, ring.tail - 1, -1):
+                for sample in decode_slots(ring.slots(n, n + 1), n):
+                    return sample
+        return None
+
+    # Expire samples before cutoff by moving each ring's tail (a bisect and
+    # a header write). Returns the bytes of slots freed; the files keep
+    # their size.
+    def drop_before(self, cutoff):
+        freed = 0
+        for device_id in self.devices():
+            with self._lock:
+                ring = self._ring(device_id)
+                if ring is not None:
+                    freed += ring.drop_before(cutoff) * SLOT_SIZE
+        return freed
+
+    # Slots are fixed-width and rewritten in place; nothing to compress
+    def seal(self, before):
+        return 0
+
+    # On top of the legacy layouts, move .seg/.gor segments left by
+    # SegmentStore into the ring, merged with anything already in it
+    def migrate_legacy(self):
+        super().migrate_legacy()
+        segments = SegmentStore(self.folder)
+        for device_id in self.devices():
+            found = segments.segments(device_id)
+            if not found:
+                continue
+            samples = list(merge(segments.read(device_id), self.read(device_id)))
+            with self._lock:
+                ring = self._rings.pop(device_id, None)
+                if ring is not None:
+                    ring.close()
+                self.ring_path(device_id).unlink(missing_ok=True)
+            self.append(device_id, self.room(device_id), samples)
+            for _, path in found:
+                path.unlink()
@@ -0,0 +1,179 @@
+import threading
+
+from .storage import DAY_MS, segment_start, to_iso
+
+RESOLUTIONS = {
+    "1m": 60 * 1000,
+    "15m": 15 * 60 * 1000,
+    "1h": 3600 * 1000,
+    "1d": DAY_MS,
+}
+METRICS = ("temperature", "humidity", "pressure")
+
+# A bucket is a flat list:
+#   [start_ms, count,
+#    t_min, t_max, t_sum, t_first, t_last,
+#    h_min, h_max, h_sum, h_first, h_last,
+#    p_min, p_max, p_sum, p_first, p_last]
+def new_bucket(start, sample):
+    bucket = [start, 1]
+    for value in sample[1:]:
+        bucket += [value, value, value, value, value]
+    return bucket
+
+def fold(bucket, sample):
+    bucket[1] += 1
+    offset = 2
+    for value in sample[1:]:
+        if value < bucket[offset]:
+            bucket[offset] = value
+        if value > bucket[offset + 1]:
+            bucket[offset + 1] = value
+        bucket[offset + 2] += value
+        bucket[offset + 4] = value
+        offset += 5
+
+def encode_bucket(bucket):
+    return ",".join(map(repr, bucket)) + "\n"
+
+def decode_bucket(line):
+    values = line.split(",")
+    if len(values) != 17:
+        raise ValueError("bad rollup line")
+    return [int(values[0]), int(values[1])] + [float(v) for v in values[2:]]
+
+def bucket_json(bucket):
+    row = {"start": to_iso(bucket[0]), "count": bucket[1]}
+    offset = 2
+    for metric in METRICS:
+        low, high, total, first, last = bucket[offset:offset + 5]
+        row[metric] = {"min": low, "max": high, "avg": total / bucket[1], "first": first, "last": last}
+        offset += 5
+    return row
+
+
+# Per-device rollups at several resolutions, maintained at ingest time.
+#
+# Every resolution keeps its current (open) bucket in memory; adding a
+# sample is O(1) per resolution. When a sample lands in a later bucket the
+# open one is closed and appended to
+#
+#   data/{device_id}/2025-12-15.r1h
+#
+# (one file per resolution and UTC day, named like the raw segments so
+# retention drops them the same way). Closed buckets are derived data: at
+# startup everything after the last persisted bucket is rebuilt from the
+# raw segments, which also backfills devices that have no rollups yet.
+class Rollups:
+    def __init__(self, store):
+        self.store = store
+        self._open = {}
+        self._lock = threading.Lock()
+
+    def path(self, device_id, resolution, start):
+        return self.store.device_dir(device_id) / (to_iso(segment_start(start))[:10] + ".r" + resolution)
+
+    def files(self, device_id, resolution):
+        found = []
+        for path in self.store.device_dir(device_id).glob("*.r" + resolution):
+            found.append((path.name[:10], path))
+        found.sort()
+        return found
+
+    # Ingest sink: fold samples (oldest first) into every resolution
+    def add(self, device_id, room, samples):
+        self._write(self._fold(device_id, samples))
+
+    # Rebuild open buckets (and any closed ones never persisted) from raw data
+    def load(self):
+        for device_id in self.store.devices():
+            resume = {}
+            for resolution, width in RESOLUTIONS.items():
+                last = self._last_closed(device_id, resolution)
+                resume[resolution] = None if last is None else last + width
+            start = None if None in resume.values() else min(resume.values())
+            self._write(self._fold(device_id, self.store.read(device_id, start), resume))
+
+    # Fold samples into the open buckets; returns {path: [closed buckets]}.
+    # With resume, a resolution only takes samples at or after its entry.
+    def _fold(self, device_id, samples, resume=None):
+        closed = {}
+        with self._lock:
+            buckets = self._open.setdefault(device_id, {})
+            for sample in samples:
+                for resolution, width in RESOLUTIONS.items():
+                    if resume is not None and resume[resolution] is not None and sample[0] < resume[resolution]:
+                        continue
+                    start = sample[0] - sample[0] % width
+                    bucket = buckets.get(resolution)
+                    if bucket is not None and bucket[0] == start:
+                        fold(bucket, sample)
+                        continue
+                    if bucket is not None:
+                        closed.setdefault(self.path(device_id, resolution, bucket[0]), []).append(bucket)
+                    buckets[resolution] = new_bucket(start, sample)
+        return closed
+
+    def _write(self, closed):
+        for path, buckets in closed.items():
+            with open(path, "a") as f:
+                f.write("".join(encode_bucket(b) for b in buckets))
+
+    def _last_closed(self, device_id, resolution):
+        files = self.files(device_id, resolution)
+        for _, path in reversed(files):
+            with open(path) as f:
+                lines = f.read().splitlines()
+            for line in reversed(lines):
+                try:
+                    return decode_bucket(line)[0]
+                except ValueError:
+                    continue
+        return None
+
+    # Buckets with start <= bucket start < end, oldest first. The open
+    # bucket is copied before the files are read: if the writer closes it
+    # meanwhile, the copy stands in for it and the file's copy is skipped.
+    def read(self, device_id, resolution, start, end):
+        with self._lock:
+            current = self._open.get(device_id, {}).get(resolution)
+            current = list(current) if current is not None else None
+        first_day = to_iso(segment_start(start))[:10]
+        last_day = to_iso(segment_start(end - 1))[:10]
+        for day, path in self.files(device_id, resolution):
+            if day < first_day:
+                continue
+            if day > last_day:
+                break
+            try:
+                f = open(path)
+            except FileNotFoundError:
+                continue
+            with f:
+                for line in f:
+                    try:
+                        bucket = decode_bucket(line)
+                    except ValueError:
+                        continue
+                    if current is not None and bucket[0] >= current[0]:
+                        continue
+                    if start <= bucket[0] < end:
+                        yield bucket
+        if current is not None and start <= current[0] < end:
+            yield current
+
+    # Unlink rollup files of days entirely before cutoff
+    def drop_before(self, cutoff):
+        reclaimed = 0
+        cutoff_day = to_iso(segment_start(cutoff) - DAY_MS)[:10]
+        for device_id in self.store.devices():
+            for resolution in RESOLUTIONS:
+                for day, path in self.files(device_id, resolution):
+                    if day > cutoff_day:
+                        break
+                    try:
+                        reclaimed += path.stat().st_size
+                        path.unlink()
+                    except FileNotFoundError:
+                        continue
+        return reclaimed
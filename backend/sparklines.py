@@ -0,0 +1,177 @@
+from array import array
+from collections import OrderedDict
+import re
+import threading
+
+from .storage import now_ms, to_iso
+
+UNITS = {"m": 60 * 1000, "h": 3600 * 1000, "d": 24 * 3600 * 1000}
+
+# "24h" / "90m" / "7d" -> milliseconds
+def parse_window(value):
+    match = re.fullmatch(r"(\d+)([mhd])", value or "")
+    if not match:
+        raise ValueError("window must look like 90m, 24h or 7d")
+    return int(match.group(1)) * UNITS[match.group(2)]
+
+
+# Fixed-size per-device series of `points` averaged buckets over a sliding
+# window. Buckets live in ring arrays indexed by bucket number, so a sample
+# is folded in O(1) and expired buckets are simply overwritten.
+class SparklineSet:
+    def __init__(self, window, points):
+        self.window = window
+        self.points = points
+        self.step = max(1, window // points)
+        self.devices = {}
+        # While the set is being built from the store: the first timestamp
+        # per device that add() folded in since the set was registered.
+        # None once the build is done.
+        self.live_from = {}
+        self.ready = threading.Event()
+
+    def _rings(self, device_id, room):
+        rings = self.devices.get(device_id)
+        if rings is None:
+            rings = self.devices[device_id] = {
+                "room": room,
+                "buckets": array("q", [-1]) * self.points,
+                "counts": array("l", [0]) * self.points,
+                "sums": array("d", [0.0]) * (3 * self.points),
+            }
+        rings["room"] = room
+        return rings
+
+    # samples oldest first
+    def add(self, device_id, room, samples):
+        if self.live_from is not None and samples:
+            self.live_from.setdefault(device_id, samples[0][0])
+        self._fold(device_id, room, samples)
+
+    # Fold in samples read from the store during the build. Anything from
+    # the first live sample on has already come in through add().
+    def backfill(self, device_id, room, samples):
+        cutoff = self.live_from.get(device_id)
+        if cutoff is not None:
+            samples = [sample for sample in samples if sample[0] < cutoff]
+            room = self.devices[device_id]["room"]
+        self._fold(device_id, room, samples)
+
+    def _fold(self, device_id, room, samples):
+        rings = self._rings(device_id, room)
+        buckets, counts, sums = rings["buckets"], rings["counts"], rings["sums"]
+        for ts, temperature, humidity, pressure in samples:
+            bucket = ts // self.step
+            slot = bucket % self.points
+            if buckets[slot] != bucket:
+                if buckets[slot] > bucket:
+                    continue
+                buckets[slot] = bucket
+                counts[slot] = 0
+                sums[3 * slot] = sums[3 * slot + 1] = sums[3 * slot + 2] = 0.0
+            counts[slot] += 1
+            sums[3 * slot] += temperature
+            sums[3 * slot + 1] += humidity
+            sums[3 * slot + 2] += pressure
+
+    # Oldest-first averages ending with the bucket that holds `now`; None
+    # marks buckets without data
+    def series(self, device_id, now):
+        rings = self.devices[device_id]
+        buckets, counts, sums = rings["buckets"], rings["counts"], rings["sums"]
+        last = now // self.step
+        values = ([], [], [])
+        for bucket in range(last - self.points + 1, last + 1):
+            slot = bucket % self.points
+            if buckets[slot] == bucket and counts[slot]:
+                for metric in range(3):
+                    values[metric].append(round(sums[3 * slot + metric] / counts[slot], 2))
+            else:
+                for metric in range(3):
+                    values[metric].append(None)
+        return {
+            "device_id": device_id,
+            "room": rings["room"],
+            "temperature": values[0],
+            "humidity": values[1],
+            "pressure": values[2],
+        }
+
+
+# Fleet-wide sparklines for a few recently requested (window, points)
+# shapes. A shape is built once from the raw segments and then kept
+# current as an ingest sink, so serving it never reads history.
+#
+# The build reads the store without holding the lock add() takes, so ingest
+# keeps going meanwhile: the new shape is registered first and picks up
+# live batches right away, and the build only fills in what came before
+# them (see SparklineSet.backfill). Builds run one at a time, and shapes
+# are limited to the configured windows split into whole minutes
+# (see check()).
+class SparklineCache:
+    # windows: allowed windows as accepted by parse_window
+    def __init__(self, store, windows, max_shapes=4):
+        self.store = store
+        self.windows = {parse_window(window): window for window in windows}
+        self.max_shapes = max_shapes
+        self._sets = OrderedDict()
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+
+    def check(self, window, points):
+        if window not in self.windows:
+            allowed = ", ".join(self.windows[w] for w in sorted(self.windows))
+            raise ValueError(f"window must be one of {allowed}")
+        if (window // 60000) % points:
+            raise ValueError("points must divide the window into whole minutes")
+
+    def add(self, device_id, room, samples):
+        with self._lock:
+            for sparklines in self._sets.values():
+                sparklines.add(device_id, room, samples)
+
+    def get(self, window, points):
+        now = now_ms()
+        key = (window, points)
+        with self._lock:
+            sparklines = self._sets.pop(key, None)
+            build = sparklines is None
+            if build:
+                sparklines = SparklineSet(window, points)
+            self._sets[key] = sparklines
+            while len(self._sets) > self.max_shapes:
+                self._sets.popitem(last=False)
+        if build:
+            try:
+                with self._build_lock:
+                    self._build(sparklines, now)
+            except BaseException:
+                with self._lock:
+                    if self._sets.get(key) is sparklines:
+                        del self._sets[key]
+                raise
+            finally:
+                sparklines.ready.set()
+        else:
+            sparklines.ready.wait()
+        with self._lock:
+            devices = [sparklines.series(device_id, now) for device_id in sorted(sparklines.devices)]
+        start = (now // sparklines.step - points + 1) * sparklines.step
+        return {
+            "window_seconds": window // 1000,
+            "points": points,
+            "step_seconds": sparklines.step / 1000,
+            "start": to_iso(start),
+            "devices": devices,
+        }
+
+    def _build(self, sparklines, now):
+        start = (now // sparklines.step - sparklines.points + 1) * sparklines.step
+        for device_id in self.store.devices():
+            room = self.store.room(device_id)
+            samples = list(self.store.read(device_id, start))
+            if samples:
+                with self._lock:
+                    sparklines.backfill(device_id, room, samples)
+        with self._lock:
+            sparklines.live_from = None
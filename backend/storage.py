@@ -0,0 +1,504 @@
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from pathlib import Path
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+import json
+import os
+import threading
+import time
+
+from . import gorilla
+
+EPOCH = datetime(1970, 1, 1)
+
+# Timestamps are kept as integer UTC epoch milliseconds internally and
+# rendered as naive ISO strings at the API edge (the dashboard appends "Z").
+def now_ms():
+    return int(time.time() * 1000)
+
+def to_iso(ms):
+    return (EPOCH + timedelta(milliseconds=ms)).isoformat()
+
+def from_iso(value):
+    dt = datetime.fromisoformat(value)
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return (dt - EPOCH) // timedelta(milliseconds=1)
+
+# Device-supplied timestamps: ISO 8601 strings (naive means UTC) or Unix
+# epoch numbers in seconds; values too large to be seconds are taken as ms.
+def parse_timestamp(value):
+    if isinstance(value, str):
+        try:
+            value = float(value)
+        except ValueError:
+            return from_iso(value)
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError(f"unsupported timestamp {value!r}")
+    return int(value) if value > 1e11 else int(value * 1000)
+
+# One sample per line: "timestamp_ms,temperature,humidity,pressure\n"
+def encode_sample(sample):
+    return "%d,%r,%r,%r\n" % sample
+
+def decode_sample(line):
+    ts, temperature, humidity, pressure = line.split(",")
+    return int(ts), float(temperature), float(humidity), float(pressure)
+
+# {"count", field: {"min", "max", "avg"}} from per-field running values
+def summary(count, lows, highs, totals):
+    result = {"count": count}
+    for i, field in enumerate(("temperature", "humidity", "pressure")):
+        result[field] = {
+            "min": lows[i] if count else None,
+            "max": highs[i] if count else None,
+            "avg": totals[i] / count if count else None,
+        }
+    return result
+
+# float32 carries ~7 significant digits; drop the widening noise so
+# 30.17 comes back as 30.17 and not 30.170000076293945
+def narrow(value):
+    return float("%.7g" % value)
+
+
+DAY_MS = 24 * 3600 * 1000
+INDEX_CACHE_SEGMENTS = 512
+# Append handles kept open, per store, before the least recently written
+# device's are closed
+HANDLE_CACHE_FILES = 256
+
+def segment_start(ms):
+    return ms - ms % DAY_MS
+
+def segment_name(start):
+    return to_iso(start)[:10] + ".seg"
+
+
+# Sorted timestamp -> byte offset index of one segment. Built with a single
+# scan the first time the segment is searched and extended from where it
+# left off when the segment has grown since.
+class SegmentIndex:
+    def __init__(self):
+        self.timestamps = array("q")
+        self.offsets = array("q")
+        self.size = 0
+
+    def refresh(self, path):
+        with open(path, "rb") as f:
+            f.seek(self.size)
+            data = f.read()
+        end = data.rfind(b"\n") + 1
+        pos = 0
+        while pos < end:
+            newline = data.index(b"\n", pos)
+            try:
+                ts = int(data[pos:data.index(b",", pos, newline)])
+            except ValueError:
+                pos = newline + 1
+                continue
+            self.timestamps.append(ts)
+            self.offsets.append(self.size + pos)
+            pos = newline + 1
+        self.size += end
+
+    # Byte offset of the first sample with timestamp >= ts
+    def offset_of(self, ts):
+        i = bisect_left(self.timestamps, ts)
+        return self.offsets[i] if i < len(self.offsets) else self.size
+
+    # (count, first timestamp, last timestamp) of samples with
+    # start <= timestamp < end; timestamps are None when count is 0
+    def extent(self, start, end):
+        lo = 0 if start is None else bisect_left(self.timestamps, start)
+        hi = len(self.timestamps) if end is None else bisect_left(self.timestamps, end)
+        if hi <= lo:
+            return 0, None, None
+        return hi - lo, self.timestamps[lo], self.timestamps[hi - 1]
+
+
+# Append-only, day-partitioned per-device sample store.
+#
+#   data/{device_id}/meta.json        {"device_id": ..., "room": ...}, rewritten
+#                                     only when the room changes
+#   data/{device_id}/2025-12-15.seg   one compact line per reading taken that
+#                                     UTC day, oldest first
+#
+#   data/{device_id}/2025-12-14.gor   a finished day, compressed by seal()
+#                                     (see gorilla.py)
+#
+# Ingest appends a single line, so its cost does not depend on how much
+# history the device already holds. Retention unlinks whole expired
+# segments and range reads only open the segments overlapping the range.
+class SegmentStore:
+    # Files per cached append handle
+    handle_files = 1
+
+    def __init__(self, folder):
+        self.folder = Path(folder)
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._rooms = {}
+        self._repaired = set()
+        self._handles = OrderedDict()
+        self._dirty = set()
+        self._indexes = OrderedDict()
+        self._index_lock = threading.Lock()
+
+    def device_dir(self, device_id):
+        return self.folder / str(device_id)
+
+    def meta_path(self, device_id):
+        return self.device_dir(device_id) / "meta.json"
+
+    def devices(self):
+        ids = []
+        for entry in self.folder.iterdir():
+            if entry.is_dir() and entry.name.isdigit():
+                ids.append(int(entry.name))
+        return sorted(ids)
+
+    # [(start_ms, path), ...] oldest first. A day can have both a .gor and,
+    # from readings that arrived late, a newer .seg; the .gor sorts first.
+    def segments(self, device_id):
+        found = []
+        for path in self.device_dir(device_id).glob("*"):
+            if path.suffix not in (".seg", ".gor"):
+                continue
+            try:
+                found.append((from_iso(path.stem), path))
+            except ValueError:
+                continue
+        found.sort()
+        return found
+
+    def room(self, device_id):
+        if device_id not in self._rooms:
+            try:
+                with open(self.meta_path(device_id)) as f:
+                    self._rooms[device_id] = json.load(f)["room"]
+            except (OSError, ValueError, KeyError):
+                self._rooms[device_id] = None
+        return self._rooms[device_id]
+
+    def _set_room(self, device_id, room):
+        if self.room(device_id) == room:
+            return
+        self.device_dir(device_id).mkdir(exist_ok=True)
+        tmp = self.meta_path(device_id).with_suffix(".tmp")
+        with open(tmp, "w") as f:
+            json.dump({"device_id": device_id, "room": room}, f)
+        os.replace(tmp, self.meta_path(device_id))
+        self._rooms[device_id] = room
+
+    # A crash mid-write can leave a partial last line; cut it off before the
+    # first append so the next record does not get glued onto it.
+    def _repair(self, path):
+        if path in self._repaired:
+            return
+        self._repaired.add(path)
+        try:
+            with open(path, "rb+") as f:
+                size = f.seek(0, os.SEEK_END)
+                if size == 0:
+                    return
+                f.seek(size - 1)
+                if f.read(1) == b"\n":
+                    return
+                keep = _last_newline(f, size) + 1
+                f.truncate(keep)
+        except FileNotFoundError:
+            pass
+
+    # Append handle for a segment. Each device keeps the handle of the
+    # segment it last wrote to, which is normally today's.
+    def _handle(self, device_id, path):
+        cached = self._handles.get(device_id)
+        if cached is not None and cached[0] == path:
+            self._handles.move_to_end(device_id)
+            return cached[1]
+        if cached is not None:
+            self._close(device_id)
+        self._repair(path)
+        f = open(path, "a")
+        self._cache_handle(device_id, path, f)
+        return f
+
+    # Remember a device's new handle. Past HANDLE_CACHE_FILES open files the
+    # least recently written devices' handles are closed (and fsynced if
+    # dirty), so a large fleet does not run into the open file limit.
+    def _cache_handle(self, device_id, path, handle):
+        self._handles[device_id] = (path, handle)
+        while len(self._handles) > max(1, HANDLE_CACHE_FILES // self.handle_files):
+            self._close(next(iter(self._handles)))
+
+    def _close(self, device_id):
+        path, f = self._handles.pop(device_id)
+        if f in self._dirty:
+            self._dirty.discard(f)
+            f.flush()
+            os.fsync(f.fileno())
+        f.close()
+
+    # Append samples [(timestamp_ms, temperature, humidity, pressure), ...],
+    # oldest first. Data is handed to the OS before returning; call sync()
+    # to make it durable.
+    def append(self, device_id, room, samples):
+        groups = {}
+        for sample in samples:
+            groups.setdefault(segment_start(sample[0]), []).append(encode_sample(sample))
+        with self._lock:
+            self._set_room(device_id, room)
+            for start, lines in groups.items():
+                f = self._handle(device_id, self.device_dir(device_id) / segment_name(start))
+                f.write("".join(lines))
+                f.flush()
+                self._dirty.add(f)
+
+    # fsync everything appended since the last sync
+    def sync(self):
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            for f in dirty:
+                os.fsync(f.fileno())
+
+    def close(self):
+        with self._lock:
+            for device_id in list(self._handles):
+                self._close(device_id)
+
+    # Up-to-date index of a segment; the most recently used ones are cached
+    def index(self, path):
+        with self._index_lock:
+            index = self._indexes.pop(path, None) or SegmentIndex()
+            self._indexes[path] = index
+            while len(self._indexes) > INDEX_CACHE_SEGMENTS:
+                self._indexes.popitem(last=False)
+            try:
+                if path.stat().st_size > index.size:
+                    index.refresh(path)
+            except FileNotFoundError:
+                pass
+            return index
+
+    # Yield samples with start <= timestamp < end, oldest first. The first
+    # segment is entered at the offset its index gives for start instead of
+    # being scanned from the beginning.
+    #
+    # seal() can replace a .seg with a .gor while this runs. The .gor holds
+    # the day's earlier files followed by the .seg, so a .seg found missing
+    # is read from the .gor, past the samples already yielded for the day.
+    def read(self, device_id, start=None, end=None):
+        day = yielded = None
+        for seg_start, path in self.segments(device_id):
+            if start is not None and seg_start + DAY_MS <= start:
+                continue
+            if end is not None and seg_start >= end:
+                break
+            if seg_start != day:
+                day, yielded = seg_start, 0
+            if path.suffix == ".gor":
+                for sample in gorilla.read(path, start, end):
+                    yielded += 1
+                    yield sample
+                continue
+            offset = 0
+            if start is not None and start > seg_start:
+                offset = self.index(path).offset_of(start)
+            try:
+                f = open(path, "rb")
+            except FileNotFoundError:
+                yield from islice(gorilla.read(path.with_suffix(".gor"), start, end), yielded, None)
+                continue
+            with f:
+                f.seek(offset)
+                for line in f:
+                    try:
+                        sample = decode_sample(line.decode())
+                    except ValueError:
+                        continue
+                    if start is not None and sample[0] < start:
+                        continue
+                    if end is not None and sample[0] >= end:
+                        return
+                    yield sample
+
+    # (count, first timestamp, last timestamp) of the samples with
+    # start <= timestamp < end, from segment indexes alone. A .seg sealed
+    # meanwhile is replaced by its .gor, which covers the whole day.
+    def extent(self, device_id, start=None, end=None):
+        total, first, last = 0, None, None
+        day = before = None
+        for seg_start, path in self.segments(device_id):
+            if start is not None and seg_start + DAY_MS <= start:
+                continue
+            if end is not None and seg_start >= end:
+                break
+            if seg_start != day:
+                day, before = seg_start, (total, first, last)
+            if path.suffix == ".gor":
+                count, lo, hi = gorilla.extent(path, start, end)
+            else:
+                count, lo, hi = self.index(path).extent(start, end)
+                if not count and not path.exists():
+                    total, first, last = before
+                    count, lo, hi = gorilla.extent(path.with_suffix(".gor"), start, end)
+            if count:
+                total += count
+                first = lo if first is None else first
+                last = hi
+        return total, first, last
+
+    # Count and per-field min/max/avg of the samples with
+    # start <= timestamp < end
+    def aggregate(self, device_id, start=None, end=None):
+        count = 0
+        lows, highs, totals = [float("inf")] * 3, [float("-inf")] * 3, [0.0] * 3
+        for sample in self.read(device_id, start, end):
+            count += 1
+            for i in range(3):
+                value = sample[i + 1]
+                if value < lows[i]:
+                    lows[i] = value
+                if value > highs[i]:
+                    highs[i] = value
+                totals[i] += value
+        return summary(count, lows, highs, totals)
+
+    # Last sample of a device, read from the tail of its newest segment
+    def latest(self, device_id):
+        for _, path in reversed(self.segments(device_id)):
+            sample = gorilla.last_sample(path) if path.suffix == ".gor" else _tail_sample(path)
+            if sample is not None:
+                return sample
+        return None
+
+    # Unlink segments that lie entirely before cutoff; returns the number of
+    # bytes reclaimed. Nothing is parsed or rewritten.
+    def drop_before(self, cutoff):
+        reclaimed = 0
+        for device_id in self.devices():
+            for seg_start, path in self.segments(device_id):
+                if seg_start + DAY_MS > cutoff:
+                    break
+                with self._lock:
+                    cached = self._handles.get(device_id)
+                    if cached is not None and cached[0] == path:
+                        self._close(device_id)
+                    try:
+                        reclaimed += path.stat().st_size
+                        path.unlink()
+                    except FileNotFoundError:
+                        continue
+                    self._repaired.discard(path)
+                    with self._index_lock:
+                        self._indexes.pop(path, None)
+        return reclaimed
+
+    # Compress the segments of days that ended before `before` into .gor
+    # files, folding in any .gor the day already has. Returns the number of
+    # bytes saved. Holds the append lock per day so late readings for the
+    # day cannot slip in between reading the .seg and unlinking it.
+    def seal(self, before):
+        saved = 0
+        for device_id in self.devices():
+            days = {}
+            for seg_start, path in self.segments(device_id):
+                if seg_start + DAY_MS > before:
+                    break
+                days.setdefault(seg_start, []).append(path)
+            for seg_start, paths in days.items():
+                if paths[-1].suffix != ".seg":
+                    continue
+                with self._lock:
+                    cached = self._handles.get(device_id)
+                    if cached is not None and cached[0] == paths[-1]:
+                        self._close(device_id)
+                    samples = list(self.read(device_id, seg_start, seg_start + DAY_MS))
+                    size = sum(path.stat().st_size for path in paths)
+                    target = paths[-1].with_suffix(".gor")
+                    tmp = target.with_suffix(".tmp")
+                    with open(tmp, "wb") as f:
+                        f.write(gorilla.encode(samples))
+                        f.flush()
+                        os.fsync(f.fileno())
+                    os.replace(tmp, target)
+                    paths[-1].unlink()
+                    self._repaired.discard(paths[-1])
+                    with self._index_lock:
+                        self._indexes.pop(paths[-1], None)
+                    saved += size - target.stat().st_size
+        return saved
+
+    # Convert the older flat layouts: pretty-printed {device_id}.json files
+    # and {device_id}.log / {device_id}.meta sample logs
+    def migrate_legacy(self):
+        for file in self.folder.glob("*.json"):
+            try:
+                with open(file) as f:
+                    data_json = json.load(f)
+                samples = [
+                    (from_iso(d["timestamp"]), float(d["temperature"]),
+                     float(d["humidity"]), float(d["pressure"]))
+                    for d in data_json.get("data", [])
+                ]
+                samples.sort(key=lambda s: s[0])
+                self.append(int(data_json["device_id"]), str(data_json["room"]), samples)
+                file.unlink()
+            except Exception:
+                continue
+
+        for file in self.folder.glob("*.log"):
+            try:
+                meta = file.with_suffix(".meta")
+                with open(meta) as f:
+                    room = json.load(f)["room"]
+                samples = []
+                with open(file) as f:
+                    for line in f:
+                        try:
+                            samples.append(decode_sample(line))
+                        except ValueError:
+                            continue
+                self.append(int(file.stem), room, samples)
+                file.unlink()
+                meta.unlink()
+            except Exception:
+                continue
+
+
+def _tail_sample(path):
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return None
+    with f:
+        size = f.seek(0, os.SEEK_END)
+        block = 256
+        while True:
+            offset = max(0, size - block)
+            f.seek(offset)
+            lines = f.read(size - offset).split(b"\n")
+            # lines[0] may be cut by the seek unless we started at 0
+            candidates = lines if offset == 0 else lines[1:]
+            for line in reversed(candidates):
+                try:
+                    return decode_sample(line.decode())
+                except ValueError:
+                    continue
+            if offset == 0:
+                return None
+            block *= 4
+
+def _last_newline(f, size):
+    pos = size
+    while pos > 0:
+        step = min(4096, pos)
+        pos -= step
+        f.seek(pos)
+        i = f.read(step).rfind(b"\n")
+        if i >= 0:
+            return pos + i
+    return -1
@@ -0,0 +1,62 @@
+import pytest
+
+from backend import binfmt
+from backend.ingest import Reading
+
+NOW = 1765789020493
+ROOMS = {7: "Hall"}
+
+
+def test_round_trip():
+    readings = [Reading(1, "Lab", 1765789020000, 21.5, 40.25, 1013.2),
+                Reading(2, "Lab", 1765789020001, -3.1, 99.9, 987.6)]
+    data = binfmt.encode(readings, "Lab")
+    assert len(data) == binfmt.HEADER.size + 3 + 2 * binfmt.RECORD.size
+    assert binfmt.decode(data, ROOMS.get, NOW) == readings
+
+
+def test_empty_room_and_zero_timestamp_use_the_known_room_and_receipt_time():
+    data = binfmt.encode([Reading(7, "", 0, 20.0, 30.0, 1000.0)])
+    assert binfmt.decode(data, ROOMS.get, NOW) == [Reading(7, "Hall", NOW, 20.0, 30.0, 1000.0)]
+
+
+def test_unicode_room():
+    data = binfmt.encode([Reading(1, "", 0, 1.0, 2.0, 3.0)], "Küche")
+    assert binfmt.decode(data, ROOMS.get, NOW)[0].room == "Küche"
+
+
+def test_header_only_packet_has_no_readings():
+    assert binfmt.decode(binfmt.encode([], "Lab"), ROOMS.get, NOW) == []
+
+
+@pytest.mark.parametrize("cut", [0, 1])
+def test_truncated_header(cut):
+    data = binfmt.encode([Reading(1, "", 0, 1.0, 2.0, 3.0)], "Lab")
+    with pytest.raises(ValueError, match="truncated header"):
+        binfmt.unpack(data[:cut])
+
+
+@pytest.mark.parametrize("cut", [3, 4, 5 + binfmt.RECORD.size - 1, 5 + binfmt.RECORD.size + 1, -1])
+def test_truncated_record(cut):
+    data = binfmt.encode([Reading(1, "", 0, 1.0, 2.0, 3.0)] * 2, "Lab")
+    with pytest.raises(ValueError, match="truncated record"):
+        binfmt.unpack(data[:cut])
+
+
+def test_unsupported_version():
+    data = bytearray(binfmt.encode([Reading(1, "", 0, 1.0, 2.0, 3.0)], "Lab"))
+    data[0] = 2
+    with pytest.raises(ValueError, match="unsupported version 2"):
+        binfmt.unpack(bytes(data))
+
+
+def test_unknown_device_without_room():
+    data = binfmt.encode([Reading(8, "", 0, 1.0, 2.0, 3.0)])
+    with pytest.raises(ValueError, match="unknown device 8"):
+        binfmt.decode(data, ROOMS.get, NOW)
+
+
+def test_timestamp_in_the_future():
+    data = binfmt.encode([Reading(1, "", NOW + 24 * 3600 * 1000, 1.0, 2.0, 3.0)], "Lab")
+    with pytest.raises(ValueError, match="future"):
+        binfmt.decode(data, ROOMS.get, NOW)
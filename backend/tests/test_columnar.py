@@ -0,0 +1,101 @@
+import pytest
+
+from backend import columnar
+from backend.columnar import ColumnStore, column_paths
+from backend.storage import DAY_MS, SegmentStore
+
+DAY = 20437 * DAY_MS  # 2025-12-15
+
+
+def sample(ts, value=20.5):
+    return (ts, value, 40.25 + value, 1000.5 - value)
+
+
+def samples_over_two_days():
+    return [sample(DAY + i * 3600 * 1000, 20.5 + i % 7) for i in range(48)]
+
+
+def test_round_trip_and_range_slicing(tmp_path):
+    store = ColumnStore(tmp_path)
+    samples = samples_over_two_days()
+    store.append(1, "Lab", samples[:30])
+    store.append(1, "Lab", samples[30:])
+    assert [path.name for _, path in store.segments(1)] == ["2025-12-15.ts", "2025-12-16.ts"]
+    assert list(store.read(1)) == samples
+
+    chunks = list(store.columns(1, samples[20][0], samples[30][0] + 1))
+    assert [len(chunk[0]) for chunk in chunks] == [4, 7]
+    assert [list(chunk[0]) for chunk in chunks] == [[s[0] for s in samples[20:24]], [s[0] for s in samples[24:31]]]
+    assert list(chunks[1][1]) == [s[1] for s in samples[24:31]]
+    assert list(store.columns(1, samples[-1][0] + 1)) == []
+    assert store.extent(1, samples[20][0], samples[30][0] + 1) == (11, samples[20][0], samples[30][0])
+    assert store.latest(1) == samples[-1]
+
+
+def test_repair_trims_columns_to_the_rows_all_of_them_hold(tmp_path):
+    store = ColumnStore(tmp_path)
+    samples = [sample(DAY + i * 1000) for i in range(3)]
+    store.append(1, "Lab", samples)
+    store.close()
+    ts_path = store.segments(1)[0][1]
+    paths = column_paths(ts_path)
+    # a torn append: two more timestamps, one more temperature, half a humidity
+    with open(paths[0], "ab") as f:
+        f.write(b"\0" * 16)
+    with open(paths[1], "ab") as f:
+        f.write(b"\0" * 4)
+    with open(paths[2], "ab") as f:
+        f.write(b"\0" * 2)
+    assert list(store.read(1)) == samples
+
+    store = ColumnStore(tmp_path)
+    store.append(1, "Lab", [sample(DAY + 5000)])
+    store.close()
+    assert [path.stat().st_size for path in paths] == [32, 16, 16, 16]
+    assert list(store.read(1)) == samples + [sample(DAY + 5000)]
+
+
+def test_aggregate(tmp_path, monkeypatch):
+    monkeypatch.setattr(columnar, "numpy", None)
+    store = ColumnStore(tmp_path)
+    samples = samples_over_two_days()
+    store.append(1, "Lab", samples)
+    start, end = samples[10][0], samples[40][0]
+    window = samples[10:40]
+    result = store.aggregate(1, start, end)
+    assert result["count"] == 30
+    for i, field in enumerate(("temperature", "humidity", "pressure"), 1):
+        values = [s[i] for s in window]
+        assert result[field]["min"] == min(values)
+        assert result[field]["max"] == max(values)
+        assert result[field]["avg"] == pytest.approx(sum(values) / 30)
+    assert store.aggregate(1, end + DAY_MS)["temperature"] == {"min": None, "max": None, "avg": None}
+
+
+def test_aggregate_with_numpy_matches_the_fallback(tmp_path, monkeypatch):
+    numpy = pytest.importorskip("numpy")
+    store = ColumnStore(tmp_path)
+    samples = samples_over_two_days()
+    store.append(1, "Lab", samples)
+    monkeypatch.setattr(columnar, "numpy", numpy)
+    vectorized = store.aggregate(1, samples[3][0], samples[45][0])
+    monkeypatch.setattr(columnar, "numpy", None)
+    assert vectorized == store.aggregate(1, samples[3][0], samples[45][0])
+
+
+def test_migrate_legacy_merges_segments_into_the_columns(tmp_path):
+    samples = samples_over_two_days()
+    segments = SegmentStore(tmp_path)
+    segments.append(1, "Lab", samples[:20])
+    segments.seal(DAY + DAY_MS)
+    segments.append(1, "Lab", samples[20:40])
+    segments.close()
+    assert [path.name for _, path in segments.segments(1)] == ["2025-12-15.gor", "2025-12-15.seg", "2025-12-16.seg"]
+
+    store = ColumnStore(tmp_path)
+    store.append(1, "Lab", samples[40:])
+    store.close()
+    store.migrate_legacy()
+    assert segments.segments(1) == []
+    assert list(store.read(1)) == samples
+    assert store.room(1) == "Lab"
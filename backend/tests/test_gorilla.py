@@ -0,0 +1,52 @@
+from backend import gorilla
+
+
+def write(tmp_path, samples):
+    path = tmp_path / "2025-12-15.gor"
+    path.write_bytes(gorilla.encode(samples))
+    return path
+
+
+def test_round_trip_scaled_and_negative(tmp_path):
+    samples = [(1765756800000 + i * 1000, -12.5 + i * 0.1, 45.25 - i, -1013.2) for i in range(600)]
+    samples = [(ts, round(t, 1), h, p) for ts, t, h, p in samples]
+    assert list(gorilla.read(write(tmp_path, samples))) == samples
+
+
+def test_round_trip_raw_values(tmp_path):
+    samples = [
+        (1000, 1 / 3, 1e300, -0.0),
+        (2000, -1 / 7, 5e-324, 2.0 ** 60),
+        (3000, 1 / 3, -1e300, 0.1 + 0.2),
+        (4000, float("inf"), 1e300, -2.5),
+    ]
+    block = gorilla.encode(samples)[len(gorilla.MAGIC):]
+    assert gorilla.BLOCK.unpack_from(block)[4:] == (gorilla.RAW,) * 3
+    assert list(gorilla.read(write(tmp_path, samples))) == samples
+
+
+def test_round_trip_every_delta_of_delta_bucket(tmp_path):
+    deltas = [1000, 1000, 1064, 1000, 1256, 1000, 3048, 1000, 10 ** 9, 1000, 1]
+    ts, samples = 1765756800000, []
+    for delta in deltas:
+        ts += delta
+        samples.append((ts, 21.5, 40.0, 1000.0))
+    samples.append((ts, 21.5, 40.0, 1000.0))
+    assert list(gorilla.read(write(tmp_path, samples))) == samples
+
+
+def test_range_read_and_extent_across_blocks(tmp_path):
+    samples = [(i * 10, float(i), 0.5, 1.0) for i in range(3 * gorilla.BLOCK_SAMPLES + 7)]
+    path = write(tmp_path, samples)
+    assert list(gorilla.read(path, 2555, 5125)) == samples[256:513]
+    assert gorilla.extent(path) == (len(samples), 0, samples[-1][0])
+    assert gorilla.extent(path, 2555, 5125) == (257, 2560, 5120)
+    assert gorilla.extent(path, 10 ** 9) == (0, None, None)
+    assert gorilla.last_sample(path) == samples[-1]
+
+
+def test_missing_file(tmp_path):
+    path = tmp_path / "missing.gor"
+    assert list(gorilla.read(path)) == []
+    assert gorilla.extent(path) == (0, None, None)
+    assert gorilla.last_sample(path) is None
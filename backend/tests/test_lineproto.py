@@ -0,0 +1,91 @@
+import pytest
+
+from backend.ingest import Reading
+from backend.lineproto import LineParser, parse_line
+
+NOW = 1765789020493
+ROOMS = {7: "Hall"}
+
+
+def parse(line, precision="ns"):
+    return parse_line(line, precision, NOW, ROOMS.get)
+
+
+def test_plain_line_with_nanosecond_timestamp():
+    reading = parse("env,device_id=6161,room=Lab temperature=30.1,humidity=74.9,pressure=1011.4 1765789020000000000")
+    assert reading == Reading(6161, "Lab", 1765789020000, 30.1, 74.9, 1011.4)
+
+
+@pytest.mark.parametrize("precision, raw", [("ns", 1765789020123456789), ("us", 1765789020123456),
+                                            ("ms", 1765789020123), ("s", 1765789020)])
+def test_precision(precision, raw):
+    expected = 1765789020000 if precision == "s" else 1765789020123
+    assert parse(f"env,device_id=1,room=Lab temperature=1,humidity=2,pressure=3 {raw}", precision).timestamp == expected
+
+
+def test_timestamp_defaults_to_receipt():
+    assert parse("env,device_id=1,room=Lab temperature=1,humidity=2,pressure=3").timestamp == NOW
+
+
+def test_escaped_tag_values():
+    reading = parse(r"env,device_id=1,room=Proteomics\ Lab\,\ East\=2 temperature=1,humidity=2,pressure=3")
+    assert reading.room == "Proteomics Lab, East=2"
+
+
+def test_escaped_comma_does_not_split_the_tag_set():
+    reading = parse(r"env,room=a\,b,device_id=1 temperature=1,humidity=2,pressure=3")
+    assert (reading.device_id, reading.room) == (1, "a,b")
+
+
+def test_quoted_string_fields_and_integer_fields():
+    line = 'env,device_id=1,room=Lab note="door open, fan=on",temperature=21i,humidity=40u,pressure=1000.5 1765789020000000000'
+    reading = parse(line)
+    assert (reading.temperature, reading.humidity, reading.pressure) == (21.0, 40.0, 1000.5)
+
+
+def test_room_falls_back_to_the_known_room():
+    assert parse("env,device_id=7 temperature=1,humidity=2,pressure=3").room == "Hall"
+
+
+@pytest.mark.parametrize("line, message", [
+    ("env,room=Lab temperature=1,humidity=2,pressure=3", "missing device_id"),
+    ("env,device_id=8 temperature=1,humidity=2,pressure=3", "missing room"),
+    ("env,device_id=1,room=Lab temperature=1,humidity=2", "fields are required"),
+    ("env,device_id=1,room=Lab", "expected measurement"),
+    ("env,device_id=1,room=Lab temperature=1,humidity=2,pressure=3 1 2", "expected measurement"),
+    ("env,device_id=1,room=Lab temperature=1,humidity=2,pressure=3 9765789020000000000", "future"),
+])
+def test_invalid_lines(line, message):
+    with pytest.raises(ValueError, match=message):
+        parse(line)
+
+
+def test_parser_joins_lines_split_across_chunks():
+    parser = LineParser("ms", NOW, ROOMS.get)
+    body = (b"# comment\n"
+            b"env,device_id=1,room=Lab\\ A temperature=1,humidity=2,pressure=3 1765789020000\n"
+            b"\n"
+            b"env,device_id=2 temperature=1,humidity=2,pressure=3\n"
+            b"env,device_id=7 temperature=4,humidity=5,pressure=6 1765789020001")
+    readings, numbers = [], []
+    for i in range(0, len(body), 7):
+        chunk = parser.feed(body[i:i + 7])
+        readings += chunk[0]
+        numbers += chunk[1]
+    chunk = parser.close()
+    readings += chunk[0]
+    numbers += chunk[1]
+
+    assert [(r.device_id, r.room) for r in readings] == [(1, "Lab A"), (7, "Hall")]
+    assert numbers == [2, 5]
+    assert parser.rejected == 1
+    assert parser.errors == ["line 4: missing room tag for unknown device 2"]
+
+
+def test_parser_caps_the_error_list():
+    parser = LineParser("ms", NOW, ROOMS.get, max_errors=2)
+    parser.feed(b"bad\n" * 5)
+    assert parser.rejected == 5
+    assert len(parser.errors) == 2
+    with pytest.raises(ValueError):
+        LineParser("h", NOW, ROOMS.get)
@@ -0,0 +1,23 @@
+import pytest
+
+from backend.live import parse_subscription
+
+
+def test_parse_subscription():
+    assert parse_subscription({"devices": [1, "2"], "rooms": ["Lab"]}) == ({1, 2}, {"Lab"})
+    assert parse_subscription({}) == (set(), set())
+    assert parse_subscription({"devices": None, "rooms": []}) == (set(), set())
+
+
+@pytest.mark.parametrize("subscribe", [
+    {"devices": 5},
+    {"devices": "6161"},
+    {"devices": ["x"]},
+    {"devices": [None]},
+    {"devices": [[1]]},
+    {"rooms": "Lab"},
+    {"rooms": [1]},
+])
+def test_parse_subscription_rejects(subscribe):
+    with pytest.raises(ValueError):
+        parse_subscription(subscribe)
@@ -0,0 +1,100 @@
+from backend import ring
+from backend.ring import HEADER_SIZE, SLOT_SIZE, RingStore
+
+
+def sample(i):
+    return (1765756800000 + i * 1000, 20.0 + i, 40.5, 1000.25)
+
+
+# Append one sample per call, so sample i is the ring's sample number i
+def fill(store, device_id, numbers):
+    for i in numbers:
+        store.append(device_id, "Lab", [sample(i)])
+
+
+def slot_offset(n, capacity):
+    return HEADER_SIZE + (n % capacity) * SLOT_SIZE
+
+
+def test_wraps_around_keeping_the_newest(tmp_path):
+    store = RingStore(tmp_path, 8)
+    store.append(1, "Lab", [sample(i) for i in range(5)])
+    store.append(1, "Lab", [sample(i) for i in range(5, 13)])
+    assert list(store.read(1)) == [sample(i) for i in range(5, 13)]
+    assert store.extent(1) == (8, sample(5)[0], sample(12)[0])
+    assert store.latest(1) == sample(12)
+    assert list(store.read(1, sample(7)[0], sample(10)[0])) == [sample(i) for i in range(7, 10)]
+    store.close()
+
+    store = RingStore(tmp_path, 8)
+    assert list(store.read(1)) == [sample(i) for i in range(5, 13)]
+    assert store.room(1) == "Lab"
+
+
+def test_append_longer_than_capacity(tmp_path):
+    store = RingStore(tmp_path, 4)
+    store.append(1, "Lab", [sample(i) for i in range(10)])
+    assert list(store.read(1)) == [sample(i) for i in range(6, 10)]
+
+
+def test_torn_slot_is_skipped_and_rebuilt(tmp_path):
+    store = RingStore(tmp_path, 8)
+    fill(store, 1, range(10))
+    store.close()
+    path = store.ring_path(1)
+    data = bytearray(path.read_bytes())
+    data[slot_offset(5, 8) + 9] ^= 0xFF
+    path.write_bytes(data)
+
+    store = RingStore(tmp_path, 8)
+    expected = [sample(i) for i in range(2, 10) if i != 5]
+    assert list(store.read(1)) == expected
+    reopened = store._rings[1]
+    assert reopened.head - reopened.tail == len(expected)
+    store.close()
+    assert list(ring.decode_slots(path.read_bytes()[HEADER_SIZE:], 0)) == expected
+
+
+def test_stale_slot_from_the_previous_lap_is_skipped(tmp_path):
+    store = RingStore(tmp_path, 4)
+    fill(store, 1, range(6))
+    store.close()
+    path = store.ring_path(1)
+    old = path.read_bytes()[slot_offset(6, 4):slot_offset(6, 4) + SLOT_SIZE]
+
+    store = RingStore(tmp_path, 4)
+    fill(store, 1, [6])
+    store.close()
+    data = bytearray(path.read_bytes())
+    data[slot_offset(6, 4):slot_offset(6, 4) + SLOT_SIZE] = old
+    path.write_bytes(data)
+
+    store = RingStore(tmp_path, 4)
+    assert list(store.read(1)) == [sample(i) for i in range(3, 6)]
+    assert store.latest(1) == sample(5)
+
+
+def test_drop_before_moves_the_tail(tmp_path):
+    store = RingStore(tmp_path, 8)
+    store.append(1, "Lab", [sample(i) for i in range(6)])
+    store.append(2, "Hall", [sample(i) for i in range(2)])
+    assert store.drop_before(sample(4)[0]) == 6 * SLOT_SIZE
+    assert list(store.read(1)) == [sample(4), sample(5)]
+    assert list(store.read(2)) == []
+    assert store.drop_before(sample(4)[0]) == 0
+    store.append(1, "Lab", [sample(6)])
+    store.close()
+
+    store = RingStore(tmp_path, 8)
+    assert list(store.read(1)) == [sample(4), sample(5), sample(6)]
+
+
+def test_capacity_change_rebuilds_keeping_the_newest(tmp_path):
+    store = RingStore(tmp_path, 8)
+    store.append(1, "Lab", [sample(i) for i in range(8)])
+    store.close()
+
+    store = RingStore(tmp_path, 3)
+    assert list(store.read(1)) == [sample(i) for i in range(5, 8)]
+    store.close()
+    assert store.ring_path(1).stat().st_size == HEADER_SIZE + 3 * SLOT_SIZE
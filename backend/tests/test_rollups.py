@@ -0,0 +1,27 @@
+from backend.rollups import Rollups
+from backend.storage import DAY_MS, SegmentStore
+
+DAY = 20437 * DAY_MS  # 2025-12-15
+MINUTE = 60 * 1000
+
+
+def sample(ts, value=20.0):
+    return (ts, value, 40.0, 1000.0)
+
+
+def test_open_bucket_closed_during_a_read_is_returned_once(tmp_path, monkeypatch):
+    store = SegmentStore(tmp_path)
+    store.append(1, "Lab", [sample(DAY)])
+    rollups = Rollups(store)
+    rollups.add(1, "Lab", [sample(DAY), sample(DAY + 1000, 30.0), sample(DAY + MINUTE)])
+    files = rollups.files
+
+    # The writer closes the open bucket between the copy and the file reads
+    def files_after_close(device_id, resolution):
+        rollups.add(1, "Lab", [sample(DAY + 2 * MINUTE)])
+        return files(device_id, resolution)
+
+    monkeypatch.setattr(rollups, "files", files_after_close)
+    buckets = list(rollups.read(1, "1m", DAY, DAY + DAY_MS))
+    assert [(bucket[0] - DAY, bucket[1]) for bucket in buckets] == [(0, 2), (MINUTE, 1)]
+    assert buckets[0][4] == 50.0
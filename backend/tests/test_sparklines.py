@@ -0,0 +1,43 @@
+import pytest
+
+from backend.sparklines import SparklineCache, SparklineSet, parse_window
+from backend.storage import SegmentStore
+
+HOUR = 3600 * 1000
+
+
+def test_backfill_skips_what_add_already_folded_in():
+    sparklines = SparklineSet(HOUR, 4)
+    sparklines.add(1, "New room", [(HOUR + 500, 30.0, 1.0, 1.0)])
+    sparklines.backfill(1, "Old room", [(HOUR + 100, 10.0, 1.0, 1.0), (HOUR + 500, 30.0, 1.0, 1.0)])
+    sparklines.live_from = None
+    series = sparklines.series(1, HOUR + 1000)
+    assert series["room"] == "New room"
+    assert series["temperature"][-1] == 20.0
+
+
+def test_build_keeps_batches_written_meanwhile(tmp_path, monkeypatch):
+    store = SegmentStore(tmp_path)
+    store.append(1, "Lab", [(1000, 10.0, 1.0, 1.0)])
+    cache = SparklineCache(store, ["1h"])
+    read = store.read
+
+    # A batch written (store first, then the sink) while the build reads
+    def read_during_ingest(device_id, start=None, end=None):
+        store.append(1, "Lab", [(2000, 40.0, 1.0, 1.0)])
+        cache.add(1, "Lab", [(2000, 40.0, 1.0, 1.0)])
+        return read(device_id, start, end)
+
+    monkeypatch.setattr(store, "read", read_during_ingest)
+    monkeypatch.setattr("backend.sparklines.now_ms", lambda: 3000)
+    result = cache.get(HOUR, 4)
+    assert result["devices"][0]["temperature"][-1] == 25.0
+
+
+def test_check_limits_shapes(tmp_path):
+    cache = SparklineCache(SegmentStore(tmp_path), ["1h", "24h"])
+    cache.check(parse_window("24h"), 96)
+    with pytest.raises(ValueError, match="one of 1h, 24h"):
+        cache.check(parse_window("2h"), 4)
+    with pytest.raises(ValueError, match="whole minutes"):
+        cache.check(HOUR, 7)
@@ -0,0 +1,145 @@
+from backend import gorilla
+from backend.storage import DAY_MS, SegmentIndex, SegmentStore, encode_sample
+
+DAY = 20437 * DAY_MS  # 2025-12-15
+
+
+def sample(ts, value=20.5):
+    return (ts, value, 40.25, 1000.5)
+
+
+def names(store, device_id=1):
+    return [path.name for _, path in store.segments(device_id)]
+
+
+def test_round_trip_across_days(tmp_path):
+    store = SegmentStore(tmp_path)
+    samples = [sample(DAY + i * 3600 * 1000, 20.5 + i) for i in range(30)]
+    store.append(1, "Lab", samples[:10])
+    store.append(1, "Lab", samples[10:])
+    assert names(store) == ["2025-12-15.seg", "2025-12-16.seg"]
+    assert list(store.read(1)) == samples
+    assert list(store.read(1, samples[5][0], samples[26][0])) == samples[5:26]
+    assert store.latest(1) == samples[-1]
+    store.close()
+
+    store = SegmentStore(tmp_path)
+    assert store.room(1) == "Lab"
+    assert store.devices() == [1]
+    assert list(store.read(1)) == samples
+
+
+def test_index_bisects_and_extends(tmp_path):
+    path = tmp_path / "2025-12-15.seg"
+    lines = [encode_sample(sample(DAY + i * 1000)) for i in range(5)]
+    path.write_text("".join(lines[:3]) + lines[3][:7])
+    index = SegmentIndex()
+    index.refresh(path)
+    assert list(index.timestamps) == [DAY, DAY + 1000, DAY + 2000]
+    assert index.offset_of(DAY + 1000) == len(lines[0])
+    assert index.offset_of(DAY + 1500) == len(lines[0]) + len(lines[1])
+    assert index.offset_of(DAY + 9000) == index.size == sum(map(len, lines[:3]))
+    assert index.extent(DAY + 500, None) == (2, DAY + 1000, DAY + 2000)
+    assert index.extent(DAY + 500, DAY + 900) == (0, None, None)
+
+    path.write_text("".join(lines))
+    index.refresh(path)
+    assert list(index.timestamps) == [DAY + i * 1000 for i in range(5)]
+    assert index.extent(None, DAY + 4000) == (4, DAY, DAY + 3000)
+
+
+def test_extent_uses_indexes_and_sealed_headers(tmp_path):
+    store = SegmentStore(tmp_path)
+    samples = [sample(DAY + i * 3600 * 1000) for i in range(48)]
+    store.append(1, "Lab", samples)
+    store.seal(DAY + DAY_MS)
+    assert names(store) == ["2025-12-15.gor", "2025-12-16.seg"]
+    assert store.extent(1) == (48, samples[0][0], samples[-1][0])
+    assert store.extent(1, samples[20][0], samples[30][0]) == (10, samples[20][0], samples[29][0])
+    assert store.extent(2) == (0, None, None)
+
+
+def test_torn_last_line_is_cut_before_the_next_append(tmp_path):
+    store = SegmentStore(tmp_path)
+    store.append(1, "Lab", [sample(DAY), sample(DAY + 1000)])
+    store.close()
+    path = tmp_path / "1" / "2025-12-15.seg"
+    with open(path, "a") as f:
+        f.write(encode_sample(sample(DAY + 2000))[:9])
+    assert list(store.read(1)) == [sample(DAY), sample(DAY + 1000)]
+
+    store = SegmentStore(tmp_path)
+    store.append(1, "Lab", [sample(DAY + 3000)])
+    store.close()
+    assert path.read_text() == "".join(encode_sample(sample(DAY + i * 1000)) for i in (0, 1, 3))
+
+
+def test_drop_before_unlinks_whole_days(tmp_path):
+    store = SegmentStore(tmp_path)
+    samples = [sample(DAY + i * 12 * 3600 * 1000) for i in range(6)]
+    store.append(1, "Lab", samples)
+    store.append(2, "Hall", samples[:1])
+    store.seal(DAY + DAY_MS)
+    size = sum(path.stat().st_size for path in tmp_path.glob("1/2025-12-1[56].*"))
+    size += (tmp_path / "2" / "2025-12-15.gor").stat().st_size
+
+    assert store.drop_before(DAY + 2 * DAY_MS + 1) == size
+    assert names(store) == ["2025-12-17.seg"]
+    assert names(store, 2) == []
+    assert list(store.read(1)) == samples[4:]
+    assert store.drop_before(DAY + 2 * DAY_MS + 1) == 0
+    store.append(1, "Lab", [sample(DAY + 3 * DAY_MS)])
+    assert list(store.read(1)) == samples[4:] + [sample(DAY + 3 * DAY_MS)]
+
+
+def test_seal_merges_a_late_segment_into_the_sealed_day(tmp_path):
+    store = SegmentStore(tmp_path)
+    samples = [sample(DAY + i * 1000, 20.5 + i) for i in range(4)]
+    late = [sample(DAY + 10000, 19.25)]
+    store.append(1, "Lab", samples + [sample(DAY + DAY_MS)])
+    assert store.seal(DAY + DAY_MS) > 0
+    store.append(1, "Lab", late)
+    assert names(store) == ["2025-12-15.gor", "2025-12-15.seg", "2025-12-16.seg"]
+    assert list(store.read(1, DAY, DAY + DAY_MS)) == samples + late
+
+    store.seal(DAY + DAY_MS)
+    assert names(store) == ["2025-12-15.gor", "2025-12-16.seg"]
+    assert list(gorilla.read(tmp_path / "1" / "2025-12-15.gor")) == samples + late
+    assert store.seal(DAY + DAY_MS) == 0
+    assert store.latest(1) == sample(DAY + DAY_MS)
+
+
+def test_read_follows_segments_sealed_meanwhile(tmp_path):
+    store = SegmentStore(tmp_path)
+    first = [sample(DAY + i * 1000) for i in range(3)]
+    second = [sample(DAY + DAY_MS + i * 1000) for i in range(3)]
+    third = [sample(DAY + 2 * DAY_MS + i * 1000) for i in range(2)]
+    late = [sample(DAY + 2 * DAY_MS + 5000)]
+    store.append(1, "Lab", first + second + third)
+    store.seal(DAY + 3 * DAY_MS)
+    store.append(1, "Lab", first + second + late)
+    store.close()
+    # a .seg alone, a .seg alone, a .gor with a late .seg
+    for path in list(tmp_path.glob("1/2025-12-1[56].gor")):
+        path.unlink()
+    assert names(store) == ["2025-12-15.seg", "2025-12-16.seg", "2025-12-17.gor", "2025-12-17.seg"]
+
+    reader = store.read(1)
+    assert next(reader) == first[0]
+    store.seal(DAY + 3 * DAY_MS)
+    assert names(store) == ["2025-12-15.gor", "2025-12-16.gor", "2025-12-17.gor"]
+    assert [first[0]] + list(reader) == first + second + third + late
+
+
+def test_extent_follows_segments_sealed_meanwhile(tmp_path, monkeypatch):
+    store = SegmentStore(tmp_path)
+    samples = [sample(DAY + i * 1000) for i in range(3)] + [sample(DAY + DAY_MS + i * 1000) for i in range(2)]
+    store.append(1, "Lab", samples[:2])
+    store.seal(DAY + DAY_MS)
+    store.append(1, "Lab", samples[2:])
+    store.close()
+    listed = store.segments(1)
+    assert names(store) == ["2025-12-15.gor", "2025-12-15.seg", "2025-12-16.seg"]
+    store.seal(DAY + 2 * DAY_MS)
+    monkeypatch.setattr(store, "segments", lambda device_id: listed)
+    assert store.extent(1) == (5, samples[0][0], samples[-1][0])
@@ -0,0 +1,70 @@
+import asyncio
+import json
+import logging
+
+from . import binfmt
+from .ingest import IngestOverloaded, parse_reading
+from .ratelimit import TokenBuckets
+from .storage import now_ms
+
+log = logging.getLogger(__name__)
+
+# Fire-and-forget UDP ingest for battery nodes that wake, send one packet
+# and sleep. A datagram is either a JSON reading (the /api/update body) or
+# a binfmt packet. Nothing is sent back; outcomes only show up in counters.
+# Each source address is rate limited before the packet is even parsed.
+class UdpIngest(asyncio.DatagramProtocol):
+    def __init__(self, ingest, room_of, rate, burst):
+        self.ingest = ingest
+        self.room_of = room_of
+        self.buckets = TokenBuckets(rate, burst)
+        self.transport = None
+        self._pending = set()
+        self.received = 0
+        self.accepted = 0
+        self.malformed = 0
+        self.limited = 0
+        self.dropped = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.received += 1
+        if not self.buckets.take(addr[0]):
+            self.limited += 1
+            return
+        try:
+            if data[:1] == b"{":
+                readings = [parse_reading(json.loads(data))]
+            else:
+                readings = binfmt.decode(data, self.room_of, now_ms())
+        except Exception:
+            self.malformed += 1
+            return
+        task = asyncio.create_task(self._submit(readings))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _submit(self, readings):
+        try:
+            results = await self.ingest.submit(readings, limit=True)
+        except IngestOverloaded:
+            self.dropped += len(readings)
+            return
+        except Exception:
+            log.exception("udp ingest failed")
+            self.dropped += len(readings)
+            return
+        accepted = sum(1 for r in results if r["status"] in ("ok", "coalesced"))
+        self.accepted += accepted
+        self.dropped += len(results) - accepted
+
+    def stats(self):
+        return {
+            "received": self.received,
+            "accepted": self.accepted,
+            "malformed": self.malformed,
+            "rate_limited": self.limited,
+            "dropped": self.dropped,
+        }
@@ -1,9 +1,17 @@
 import { useEffect, useState } from "react";
 
 const ONLINE_THRESHOLD_MS = 5 * 60 * 1000; // 5 minutes
+const SNAPSHOT_TIMEOUT_MS = 15000; // live stream must deliver a snapshot by then
+const MAX_STREAM_ERRORS = 3; // stream errors before falling back to polling
+
+const withDate = (d) => ({
+  ...d,
+  lastSeen: new Date(d.timestamp + "Z"), // force UTC parsing
+});
 
 export default function App() {
   const [devices, setDevices] = useState([]);
+  const [, setNow] = useState(Date.now());
 
   const fetchLatest = async () => {
     try {
@@ -11,21 +19,70 @@ export default function App() {
       const data = await res.json();
 
       // Ensure each device has a proper Date object
-      const devicesWithDate = data.map((d) => ({
-        ...d,
-        lastSeen: new Date(d.timestamp + "Z"), // force UTC parsing
-      }));
-
-      setDevices(devicesWithDate);
+      setDevices(data.map(withDate));
     } catch (err) {
       console.error("Failed to fetch latest devices", err);
     }
   };
 
   useEffect(() => {
+    // Re-render every minute so ONLINE/OFFLINE badges age without new data
+    const tick = setInterval(() => setNow(Date.now()), 60000);
+    let interval = null;
+    let source = null;
+    let snapshotTimer = null;
+
+    const startPolling = () => {
+      if (interval !== null) return;
+      interval = setInterval(fetchLatest, 120000); // poll every 2 minutes
+    };
+
+    // Show something right away, whatever happens to the stream
     fetchLatest();
-    const interval = setInterval(fetchLatest, 120000); // poll every 2 minutes
-    return () => clearInterval(interval);
+
+    if (typeof EventSource === "undefined") {
+      startPolling();
+    } else {
+      // Live updates; the browser reconnects and resumes on its own. A proxy
+      // that blocks or buffers the stream shows up as repeated errors or as
+      // no snapshot arriving, and then the dashboard polls instead.
+      source = new EventSource("/api/stream");
+      let errors = 0;
+      const fallBack = () => {
+        clearTimeout(snapshotTimer);
+        source.close();
+        startPolling();
+      };
+      snapshotTimer = setTimeout(fallBack, SNAPSHOT_TIMEOUT_MS);
+      source.addEventListener("snapshot", (e) => {
+        errors = 0;
+        clearTimeout(snapshotTimer);
+        setDevices(JSON.parse(e.data).map(withDate));
+      });
+      source.addEventListener("reading", (e) => {
+        const device = withDate(JSON.parse(e.data));
+        setDevices((prev) => {
+          const index = prev.findIndex((d) => d.device_id === device.device_id);
+          if (index === -1) return [...prev, device];
+          const next = [...prev];
+          next[index] = device;
+          return next;
+        });
+      });
+      source.addEventListener("error", () => {
+        errors += 1;
+        if (errors >= MAX_STREAM_ERRORS || source.readyState === EventSource.CLOSED) {
+          fallBack();
+        }
+      });
+    }
+
+    return () => {
+      clearInterval(tick);
+      clearInterval(interval);
+      clearTimeout(snapshotTimer);
+      if (source) source.close();
+    };
   }, []);
 
   return (